@@ -0,0 +1,320 @@
+import heapq
+import threading
+from array import array
+from collections import Counter
+
+from instrument import instruments
+
+FRIENDLY_STATUSES = ("Friend", "Best Friends", "Together")  #Relationships a "through friends" path may follow
+PAGERANK_ITERATIONS = 30
+
+
+class NetworkAnalytics:
+    """Queries over a RelationshipStore that are kept or cached between changes instead of recomputed.
+
+    The network owning the store reports every change through the *_added,
+    *_renamed and *_removed hooks. Connected components live in a union-find
+    over the numbers the store gives its people, see numbered_edges, that
+    only ever merges: new people and relationships update it in place, and
+    only a removal, which can split a group, drops it to be rebuilt on the
+    next query. Whole-network results such as rankings are cached until the
+    next change.
+
+    The groups, the most connected and the most central person, which take
+    passes over the whole network, can be prepared on a background thread
+    from a frozen copy of the store instead, see prepare_in_background.
+    """
+
+    def __init__(self, store, lock=None):
+        self.store = store
+        self.lock = lock or threading.RLock()  #Held by everything that changes the store
+        self._waiting = []  #Callbacks for the running prepare_in_background
+        self.version = 0  #Bumped on every change, whole-network results are cached per version
+        self._cache = {}
+        self._cache_version = 0
+        self._ids = None  #The store's PersonNumbers, None until components are first asked for
+        self._parent = array("q")
+        self._size = array("q")
+        self._component_count = 0
+
+    def reset(self):
+        """Forgets everything, for when the store was replaced wholesale."""
+        self.version += 1
+        self._ids = None
+
+    def person_added(self, name):
+        self.version += 1
+        if self._ids is not None:
+            i = self._ids.add(name)
+            while len(self._parent) <= i:  #Numbers can skip those of removed people
+                self._parent.append(len(self._parent))
+                self._size.append(0)
+            self._size[i] = 1
+            self._component_count += 1
+
+    def person_renamed(self, old_name, new_name):
+        self.version += 1
+        if self._ids is not None:
+            self._ids.rename(old_name, new_name)
+
+    def person_removed(self, name):
+        self.reset()
+
+    def relationship_added(self, u, v):
+        self.version += 1
+        if self._ids is not None:
+            self._union(self._ids[u], self._ids[v])
+
+    def relationship_changed(self, u, v):
+        self.version += 1
+
+    def relationship_removed(self, u, v):
+        self.reset()
+
+    def components_ready(self):
+        """Whether the groups can be asked about without labelling them first."""
+        return self._ids is not None
+
+    @instruments.timed("analytics.prepare")
+    def prepare(self):
+        """Labels the groups and finds the most connected and most central people without holding the lock.
+
+        Returns (group count, size of the largest group, most_connected(1),
+        most_central(1)), or None if the network changed meanwhile and the
+        results were dropped. Only freezing the store happens under the lock,
+        everything else runs on the frozen copy.
+        """
+        with self.lock:
+            version = self.version
+            frozen = self.store.freeze()
+        scratch = NetworkAnalytics(frozen)
+        groups = scratch.component_count()
+        largest = scratch.largest_components(1)
+        top = scratch.most_connected(1)
+        numbers, ranked = scratch._rank_numbers(1)
+
+        with self.lock:
+            if self.version != version:
+                return None
+            if self._ids is None:
+                self._parent, self._size = scratch._parent, scratch._size
+                self._component_count = groups
+                self._ids = scratch._ids  #Last, other threads take it to mean the groups are ready
+            if self._cache_version != version:
+                self._cache.clear()
+                self._cache_version = version
+            self._cache[("most_connected", 1)] = top
+            #Names are looked up here, a database's numbers read them from the live store
+            central = self._cache[("most_central", 1)] = [(numbers.name(i), score) for i, score in ranked]
+        return groups, largest[0] if largest else 0, top, central
+
+    def prepare_in_background(self, on_ready):
+        """Runs prepare on a background thread until it succeeds, then calls on_ready with its results there.
+
+        Calls made while it runs share its results.
+        """
+        with self.lock:
+            self._waiting.append(on_ready)
+            if len(self._waiting) > 1:
+                return
+        threading.Thread(target=self._prepare_until_done, name="Analytics", daemon=True).start()
+
+    def _prepare_until_done(self):
+        result = None
+        while result is None:
+            result = self.prepare()
+        with self.lock:
+            waiting, self._waiting = self._waiting, []
+        for on_ready in waiting:
+            on_ready(*result)
+
+    def status_degree(self, name):
+        """Returns {status: count} of name's relationships."""
+        return Counter(self.store.relations(name).values())
+
+    def component_count(self):
+        self._build_components()
+        return self._component_count
+
+    def component_size(self, name):
+        """Returns how many people can be reached from name, name included."""
+        self._build_components()
+        return self._size[self._find(self._ids[name])]
+
+    def same_component(self, u, v):
+        self._build_components()
+        return self._find(self._ids[u]) == self._find(self._ids[v])
+
+    def largest_components(self, k=5):
+        """Returns the sizes of the k largest groups of connected people."""
+        self._build_components()
+        roots = (i for i, parent in enumerate(self._parent) if i == parent and self._size[i])
+        return heapq.nlargest(k, (self._size[i] for i in roots))
+
+    def most_connected(self, k=10):
+        """Returns [(name, degree)] for the k people with the most relationships."""
+        return self._cached(("most_connected", k), lambda: heapq.nlargest(
+            k, self.store.degrees(), key=lambda x: x[1]))
+
+    def most_central(self, k=10):
+        """Returns [(name, score)] for the k people with the highest PageRank."""
+        def compute():
+            numbers, ranked = self._rank_numbers(k)
+            return [(numbers.name(i), score) for i, score in ranked]
+        return self._cached(("most_central", k), compute)
+
+    @instruments.timed("analytics.path")
+    def shortest_path(self, source, target, statuses=None):
+        """Returns the fewest steps from source to target as a list of names, or None if they are not connected.
+
+        With statuses, only relationships with one of those statuses are
+        followed. Searches from both ends at once, always growing the smaller
+        side, so the people visited stay far fewer than the whole network.
+        """
+        store = self.store
+        if source not in store or target not in store:
+            return None
+        if source == target:
+            return [source]
+        #Only ruled out up front when the groups are labelled already, labelling them can take longer than searching
+        if statuses is None and self.components_ready() and not self.same_component(source, target):
+            return None
+        allowed = None if statuses is None else set(statuses)
+
+        forward, backward = {source: None}, {target: None}  #Person -> the person they were reached from
+        forward_frontier, backward_frontier = [source], [target]
+        while forward_frontier and backward_frontier:
+            reversed_search = len(backward_frontier) < len(forward_frontier)
+            if reversed_search:
+                frontier, seen, other = backward_frontier, backward, forward
+            else:
+                frontier, seen, other = forward_frontier, forward, backward
+
+            next_frontier = []
+            for name in frontier:
+                for neighbour, status in store.relations(name).items():
+                    if neighbour in seen or (allowed is not None and status not in allowed):
+                        continue
+                    seen[neighbour] = name
+                    if neighbour in other:
+                        return _join_path(forward, backward, neighbour)
+                    next_frontier.append(neighbour)
+
+            if reversed_search:
+                backward_frontier = next_frontier
+            else:
+                forward_frontier = next_frontier
+        return None
+
+    def _cached(self, key, compute):
+        if self._cache_version != self.version:
+            self._cache.clear()
+            self._cache_version = self.version
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _build_components(self):
+        if self._ids is not None:
+            return
+
+        self._label_components()
+
+    @instruments.timed("analytics.components")
+    def _label_components(self):
+        #Labels each group with array passes over the relationships, batch by batch, rather than a lookup per
+        #relationship, then later relationships are merged in by union-find
+        import numpy as np
+
+        numbers, people, edges = self.store.numbered_edges()
+        labels = np.arange(int(people.max()) + 1 if len(people) else 0)
+        for src, dst in edges:
+            _hook(labels, src, dst)
+
+        self._ids = numbers
+        self._parent = array("q", labels.astype(np.int64).tobytes())
+        self._size = array("q", np.bincount(labels[people], minlength=len(labels)).astype(np.int64).tobytes())
+        self._component_count = int(np.count_nonzero(labels[people] == people))
+
+    def _find(self, i):
+        parent = self._parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  #Path halving
+            i = parent[i]
+        return i
+
+    def _union(self, i, j):
+        i, j = self._find(i), self._find(j)
+        if i == j:
+            return
+        if self._size[i] < self._size[j]:
+            i, j = j, i
+        self._parent[j] = i
+        self._size[i] += self._size[j]
+        self._size[j] = 0
+        self._component_count -= 1
+
+    @instruments.timed("analytics.pagerank")
+    def _rank_numbers(self, k, damping=0.85):
+        #Returns (numbers, [(number, score)]) for the k highest PageRanks, computed with NumPy over the numbered
+        #relationships, so a database never reads a name until the few ranked are looked up
+        import numpy as np  #Only rankings need NumPy
+
+        numbers, people, edges = self.store.numbered_edges()
+        if not len(people):
+            return numbers, []
+        #Undirected, so every relationship passes rank both ways
+        sources, targets = [], []
+        for batch_src, batch_dst in edges:
+            sources.append(batch_src)
+            targets.append(batch_dst)
+        src = np.concatenate(sources + targets) if sources else np.zeros(0, dtype=np.int64)
+        dst = np.concatenate(targets + sources) if sources else src
+        src, dst = src[src != dst], dst[src != dst]  #Someone related to themselves passes rank to no one else
+        size = int(people.max()) + 1  #Numbers can skip those of removed people, who get no rank
+        base = np.zeros(size)
+        base[people] = 1.0 / len(people)
+        out_degree = np.bincount(src, minlength=size).astype(float)
+        dangling = people[out_degree[people] == 0]
+
+        rank = base.copy()
+        for _ in range(PAGERANK_ITERATIONS):
+            share = np.divide(rank, out_degree, out=np.zeros(size), where=out_degree > 0)
+            rank = (1 - damping) * base + damping * (np.bincount(dst, weights=share[src], minlength=size)
+                                                     + rank[dangling].sum() * base)
+        top = people[np.argsort(-rank[people], kind="stable")[:k]]
+        return numbers, [(int(i), float(rank[i])) for i in top]
+
+
+def _hook(labels, src, dst):
+    #labels maps every number to the lowest number in its group found so far, with no chains: a label is its own
+    #label. Hooks the higher label of the two ends of every relationship onto the lower one until they agree.
+    import numpy as np
+
+    while len(src):
+        a, b = labels[src], labels[dst]
+        apart = a != b
+        src, dst, a, b = src[apart], dst[apart], a[apart], b[apart]
+        if not len(src):
+            return
+        np.minimum.at(labels, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            #Jumps each label to its label's label until there are no chains left
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels[:] = jumped
+
+
+def _join_path(forward, backward, meeting):
+    path = []
+    name = meeting
+    while name is not None:
+        path.append(name)
+        name = forward[name]
+    path.reverse()
+    name = backward[meeting]
+    while name is not None:
+        path.append(name)
+        name = backward[name]
+    return path
@@ -0,0 +1,319 @@
+"""Benchmarks for the relationship mapper's data layer.
+
+Compare the cold-start time of loading a JSON data file against a binary
+snapshot of the same synthetic network, by edge count:
+
+    python benchmark.py formats 10000 100000 1000000
+
+Time renaming and removing people as the network grows, by people count:
+
+    python benchmark.py edits 1000 10000 200000
+
+Time importing the headless core against the GUI module, each in a fresh
+interpreter, and list the heavy dependencies each one pulls in:
+
+    python benchmark.py imports
+
+Run the whole suite (load, save, rename, remove, search, layout and draw) on
+seeded power-law networks of 1k to 1M people, each size in a fresh process,
+saving the timings and peak memory as JSON and comparing them against an
+earlier run:
+
+    python benchmark.py suite --output results.json
+    python benchmark.py suite 1000 10000 --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from layout import LAYOUT_ENGINES
+from persistence import RELATIONSHIP_STATUSES, export_records, load_file
+from store import RelationshipStore
+
+HEAVY_MODULES = ("tkinter", "matplotlib", "networkx", "numpy")
+SUITE_SIZES = (1000, 10000, 100000, 1000000)
+SUITE_OPERATIONS = ("load", "rename", "remove", "save", "search", "layout", "draw")
+SAMPLE_SIZE = 100  #People renamed and removed per run
+SEARCH_QUERIES = ("person 1", "son 42", "7", "no such name")
+NOISE_SECONDS = 0.001  #Differences from the baseline below this are never regressions
+#Share of relationships with each status, roughly as they occur in real networks
+STATUS_MIX = {"Friend": 0.30, "Acquaintances": 0.22, "Best Friends": 0.08, "Likes": 0.08, "Distant": 0.08,
+              "Together": 0.06, "Dislike": 0.05, "Complicated": 0.05, "Exes": 0.04, "Situationship": 0.04}
+
+
+def synthetic_network(edge_count, seed=0):
+    """Returns (people, edges) for a random network with edge_count distinct relationships."""
+    rng = random.Random(seed)
+    people = [f"Person {i}" for i in range(max(edge_count // 5, 50))]
+    edges = {}
+    while len(edges) < edge_count:
+        u = rng.randrange(len(people))
+        v = rng.randrange(len(people))
+        if u != v:
+            edges[(min(u, v), max(u, v))] = rng.choice(RELATIONSHIP_STATUSES)
+    return people, [(people[u], people[v], status) for (u, v), status in edges.items()]
+
+
+def power_law_network(people_count, mean_degree=10, exponent=2.5, seed=0):
+    """Returns (people, edges) for a seeded random social network whose degrees follow a power law.
+
+    Both ends of every relationship are drawn with probability proportional to
+    a Chung-Lu weight of rank ** (-1 / (exponent - 1)), so a few people have
+    hundreds of relationships and most have a handful. Statuses follow
+    STATUS_MIX. The same arguments always give the same network.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    weights = np.arange(1, people_count + 1) ** (-1 / (exponent - 1))
+    weights /= weights.sum()
+    draws = people_count * mean_degree // 2
+    u = rng.choice(people_count, size=draws, p=weights)
+    v = rng.choice(people_count, size=draws, p=weights)
+    #Drops self-relationships and repeated pairs, which leaves hubs a little short of their expected degree
+    keep = u != v
+    pairs = np.unique(np.minimum(u, v)[keep].astype(np.int64) * people_count + np.maximum(u, v)[keep])
+    statuses = list(STATUS_MIX)
+    codes = rng.choice(len(statuses), size=len(pairs), p=list(STATUS_MIX.values()))
+
+    #Numbers people in a shuffled order, so the best connected are not also first alphabetically
+    people = [f"Person {i}" for i in rng.permutation(people_count).tolist()]
+    edges = [(people[a], people[b], statuses[code])
+             for a, b, code in zip((pairs // people_count).tolist(), (pairs % people_count).tolist(), codes.tolist())]
+    return people, edges
+
+
+def time_load(path):
+    start = time.perf_counter()
+    load_file(RelationshipStore(), path)
+    return time.perf_counter() - start
+
+
+def cold_start(path):
+    """Loads path in a fresh interpreter so no state is shared between runs."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, __file__, "--load", path], check=True,
+                            capture_output=True, text=True).stdout
+    return float(output), time.perf_counter() - start
+
+
+def time_import(module):
+    """Imports module in a fresh interpreter, returning the seconds it took and the heavy modules it loaded."""
+    code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start, *[name for name in {HEAVY_MODULES!r} if name in sys.modules])")
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+    return float(output[0]), output[1:]
+
+
+def bench_imports(modules, repeat=5):
+    print(f"{'module':>14} {'import ms':>10}  loaded")
+    for module in modules:
+        times = []
+        for _ in range(repeat):
+            elapsed, loaded = time_import(module)
+            times.append(elapsed)
+        print(f"{module:>14} {sorted(times)[len(times) // 2] * 1000:>10.1f}  {', '.join(loaded) or '-'}")
+
+
+def bench_formats(edge_counts):
+    print(f"{'edges':>10} {'format':>6} {'size MB':>9} {'load s':>8} {'process s':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for edge_count in edge_counts:
+            people, edges = synthetic_network(edge_count)
+            for extension in (".json", ".rmap"):
+                path = os.path.join(directory, f"network-{edge_count}{extension}")
+                export_records(path, people, edges)
+                load, process = cold_start(path)
+                size = os.path.getsize(path) / 1e6
+                print(f"{edge_count:>10} {extension[1:]:>6} {size:>9.1f} {load:>8.3f} {process:>10.3f}")
+
+
+def bench_edits(people_counts, repeat=1000):
+    """Times rename_person and remove_person, which should stay flat as the network grows."""
+    print(f"{'people':>10} {'edges':>10} {'rename us':>10} {'remove us':>10}")
+    for people_count in people_counts:
+        people, edges = synthetic_network(people_count * 5)
+        store = RelationshipStore()
+        store.add_people(people)
+        store.add_relationships(edges)
+        sample = random.Random(1).sample(people, min(repeat, len(people)))
+
+        start = time.perf_counter()
+        for name in sample:
+            store.rename_person(name, name + " (renamed)")
+        rename = (time.perf_counter() - start) / len(sample) * 1e6
+
+        start = time.perf_counter()
+        for name in sample:
+            store.remove_person(name + " (renamed)")
+        remove = (time.perf_counter() - start) / len(sample) * 1e6
+        print(f"{len(people):>10} {len(edges):>10} {rename:>10.2f} {remove:>10.2f}")
+
+
+def peak_memory_mb():
+    """Returns the peak resident memory of this process so far, or None where the platform cannot tell."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  #Bytes on macOS, KiB elsewhere
+
+
+def run_suite_size(people_count, operations=SUITE_OPERATIONS, engine="auto", seed=0):
+    """Times each operation on one network size, in this process, returning the result for the JSON report.
+
+    Single changes and searches are timed per call, averaged over the sample.
+    """
+    from core import RelationshipNetwork
+    from render import render_map
+
+    people, edges = power_law_network(people_count, seed=seed)
+    seconds = {}
+    peak_mb = {"generate": peak_memory_mb()}
+    sample = random.Random(seed).sample(people, min(SAMPLE_SIZE, len(people)))
+
+    def timed(operation, run, calls=1):
+        start = time.perf_counter()
+        result = run()
+        seconds[operation] = (time.perf_counter() - start) / calls
+        peak_mb[operation] = peak_memory_mb()
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        data_file = os.path.join(directory, "relationships.json")
+        export_records(data_file, people, edges)
+        del people, edges
+        network = RelationshipNetwork(data_file)
+        timed("load", network.load)
+        network.start_writer()  #As in the app, changes return before they reach the journal
+
+        if "rename" in operations:
+            timed("rename", lambda: [network.commit_change("rename_person", name, name + " (renamed)")
+                                     for name in sample], len(sample))
+            sample = [name + " (renamed)" for name in sample]
+        if "remove" in operations:
+            timed("remove", lambda: [network.commit_change("remove_person", name) for name in sample], len(sample))
+        if "save" in operations:
+            network.backend.writer.flush()
+            timed("save", network.save)
+        if "search" in operations:
+            timed("search", lambda: [network.people_index.search(query) for query in SEARCH_QUERIES],
+                  len(SEARCH_QUERIES))
+        if "layout" in operations or "draw" in operations:
+            positions = timed("layout", lambda: network.map_positions(engine))
+            if "draw" in operations:
+                timed("draw", lambda: render_map(os.path.join(directory, "map.png"), network.store, positions))
+        network.close()
+
+    return {"people": len(network.store), "relationships": network.store.relationship_count,
+            "seconds": seconds, "peak_mb": peak_mb}
+
+
+def run_suite(sizes, operations=SUITE_OPERATIONS, engine="auto", seed=0, repeat=3):
+    """Runs every size repeat times, each in a fresh interpreter, keeping the median time and the highest peak.
+
+    Separate processes keep time and peak memory from carrying over between
+    runs and sizes.
+    """
+    results = {}
+    for people_count in sizes:
+        command = [sys.executable, __file__, "--suite-size", str(people_count), "--layout", engine,
+                   "--seed", str(seed), "--operations", *operations]
+        runs = [json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+                for _ in range(repeat)]
+        result = runs[0]
+        result["seconds"] = {operation: sorted(run["seconds"][operation] for run in runs)[len(runs) // 2]
+                             for operation in result["seconds"]}
+        result["peak_mb"] = {operation: max(run["peak_mb"][operation] or 0 for run in runs) or None
+                             for operation in result["peak_mb"]}
+        results[str(people_count)] = result
+        print_suite_size(people_count, result)
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "seed": seed, "layout": engine, "repeat": repeat, "results": results}
+
+
+def print_suite_size(people_count, result):
+    print(f"{people_count} people, {result['relationships']} relationships")
+    for operation, elapsed in result["seconds"].items():
+        peak = result["peak_mb"].get(operation)
+        peak = "" if peak is None else f"{peak:>10.0f} MB peak"
+        print(f"  {operation:>8} {elapsed * 1000:>12.3f} ms{peak}")
+
+
+def compare_results(results, baseline, tolerance):
+    """Prints each timing against the baseline run and returns the (size, operation) pairs that got slower."""
+    regressions = []
+    print(f"{'people':>10} {'operation':>10} {'baseline ms':>12} {'now ms':>10} {'change':>8}")
+    for size, result in results["results"].items():
+        before = baseline["results"].get(size)
+        if before is None:
+            continue
+        for operation, elapsed in result["seconds"].items():
+            previous = before["seconds"].get(operation)
+            if previous is None:
+                continue
+            change = elapsed / previous - 1 if previous else 0.0
+            slower = change > tolerance and elapsed - previous > NOISE_SECONDS
+            if slower:
+                regressions.append((size, operation))
+            print(f"{size:>10} {operation:>10} {previous * 1000:>12.3f} {elapsed * 1000:>10.3f} {change:>+8.0%}"
+                  f"{'  REGRESSION' if slower else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--load", help=argparse.SUPPRESS)
+    parser.add_argument("--suite-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--operations", nargs="+", choices=SUITE_OPERATIONS, default=SUITE_OPERATIONS,
+                        help=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command")
+    formats = commands.add_parser("formats", help="cold-start load time of JSON and binary snapshots")
+    formats.add_argument("edge_counts", nargs="*", type=int, default=[10000, 100000, 1000000])
+    edits = commands.add_parser("edits", help="rename and remove time as the network grows")
+    edits.add_argument("people_counts", nargs="*", type=int, default=[1000, 10000, 100000, 200000])
+    imports = commands.add_parser("imports", help="import time of the core and the GUI")
+    imports.add_argument("modules", nargs="*", default=["core", "render", "connectivity"])
+    suite = commands.add_parser("suite", help="time every operation on power-law networks, by people count")
+    suite.add_argument("sizes", nargs="*", type=int, default=list(SUITE_SIZES))
+    suite.add_argument("--skip", nargs="+", default=[], choices=SUITE_OPERATIONS, help="operations not to run")
+    suite.add_argument("--output", help="write the results to this JSON file")
+    suite.add_argument("--baseline", help="compare against the results in this JSON file")
+    suite.add_argument("--tolerance", type=float, default=0.2, help="slowdown over the baseline that fails the run")
+    suite.add_argument("--repeat", type=int, default=3, help="runs per size, the median time is kept")
+    for command in (parser, suite):
+        command.add_argument("--layout", default="auto", choices=LAYOUT_ENGINES)
+        command.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.load:
+        print(time_load(args.load))
+    elif args.suite_size:
+        print(json.dumps(run_suite_size(args.suite_size, args.operations, args.layout, args.seed)))
+    elif args.command == "suite":
+        operations = [operation for operation in SUITE_OPERATIONS if operation not in args.skip]
+        results = run_suite(args.sizes, operations, args.layout, args.seed, args.repeat)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            if compare_results(results, baseline, args.tolerance):
+                sys.exit(1)
+    elif args.command == "formats":
+        bench_formats(args.edge_counts)
+    elif args.command == "edits":
+        bench_edits(args.people_counts)
+    elif args.command == "imports":
+        bench_imports(args.modules)
+    else:
+        parser.print_help()
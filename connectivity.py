@@ -1,25 +1,44 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
-import networkx as nx
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Button
-import json
 import os
+import sys
 import threading
 
+from analytics import FRIENDLY_STATUSES
+from core import BatchError, RelationshipNetwork
+from importer import read_import
+from instrument import instruments
+from layout import LAYOUT_ENGINES
+from persistence import RELATIONSHIP_STATUSES, read_changes
+from widgets import ThreadCalls, VirtualListbox
+
+
+SEARCH_DELAY_MS = 150  #Pause in typing before the people list is filtered
+COMBOBOX_LIMIT = 200  #Most people offered in a relationship dropdown at once
+PICK_RADIUS_PX = 15  #How close to a person a click on the map has to land
+ALL_STATUSES = "All statuses"
+CHANGE_FILE_TYPES = [("CSV Files", "*.csv")]
+TRACE_FILE_TYPES = [("Chrome Trace Files", "*.json")]
+PROFILE_FILE_TYPES = [("cProfile Stats", "*.prof")]
+STATS_REFRESH_MS = 1000  #How often an open stats panel shows the latest numbers
+DATA_FILE_TYPES = [("JSON Files", "*.json"), ("JSON Lines Files", "*.jsonl"), ("Binary Snapshots", "*.rmap"),
+                   ("SQLite Databases", "*.db *.sqlite *.sqlite3")]
+
 
 class RelationshipMapper:
-    def __init__(self, root):
+    def __init__(self, root, data_file="relationships.json"):
         self.root = root
         self.root.title("Relationship Mapper")
-        self.network = nx.Graph()
-        self.relationships = {}
-        self.data_file = "relationships.json"
-        self.auto_save_interval = 300  #Auto-saves every 5 minutes
+        self.network = RelationshipNetwork(data_file)  #A .rmap path switches to the binary format, .db to SQLite
+        self.store = self.network.store
+        self.people_index = self.network.people_index
+        self.search_job = None
+        self.thread_calls = ThreadCalls(root)  #Results from the writer, import and analytics threads come back here
 
-        self.load_data()
+        self.network.load()
         self.setup_gui()
-        self.start_auto_save()
+        self.start_writer()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_gui(self):
         #Adding a Person Section
@@ -45,8 +64,8 @@ class RelationshipMapper:
         self.search_entry.grid(row=1, column=1, padx=5, pady=5)
         self.search_entry.bind("<KeyRelease>", self.search_people)
 
-        #List of People
-        self.people_listbox = tk.Listbox(self.root, height=10, selectmode=tk.SINGLE)
+        #List of People, only the visible rows are ever created
+        self.people_listbox = VirtualListbox(self.root, height=10, selectmode=tk.SINGLE)
         self.people_listbox.grid(row=2, column=0, columnspan=4, padx=5, pady=5, sticky="ew")
         self.people_listbox.bind('<<ListboxSelect>>', self.open_person_gui)
 
@@ -60,20 +79,55 @@ class RelationshipMapper:
         self.import_button = ttk.Button(self.root, text="Import Data", command=self.import_data)
         self.import_button.grid(row=3, column=2, padx=5, pady=10)
 
+        self.changes_button = ttk.Button(self.root, text="Import Changes", command=self.import_changes)
+        self.changes_button.grid(row=3, column=4, padx=5, pady=10)
+
+        #Layout engine used by Generate Map, "auto" picks one by network size
+        self.layout_combobox = ttk.Combobox(self.root, values=LAYOUT_ENGINES, state="readonly", width=8)
+        self.layout_combobox.set("auto")
+        self.layout_combobox.grid(row=3, column=3, padx=5, pady=10)
+
+        #Relationships shown by Generate Map
+        self.map_status_combobox = ttk.Combobox(self.root, values=(ALL_STATUSES, *RELATIONSHIP_STATUSES),
+                                                state="readonly", width=14)
+        self.map_status_combobox.set(ALL_STATUSES)
+        self.map_status_combobox.grid(row=3, column=5, padx=5, pady=10)
+
         #Status Bar
         self.status_bar = ttk.Label(self.root, text="Welcome to Relationship Mapper!", anchor="w")
         self.status_bar.grid(row=4, column=0, columnspan=4, sticky="we", padx=5, pady=5)
 
+        self.stats_button = ttk.Button(self.root, text="Stats", command=self.open_stats)
+        self.stats_button.grid(row=4, column=4, padx=5, pady=5)
+
         self.refresh_people_listbox()
+        self.show_summary("Welcome to Relationship Mapper!")
+
+    def show_summary(self, prefix):
+        #Shows the size of the network now, and its groups and most central person once they are found off the Tk thread
+        size = f"{len(self.store)} people and {self.store.relationship_count} relationships"
+        placeholder = f"{prefix} {size}, counting groups..."
+        self.set_status(placeholder)
+
+        def on_ready(groups, largest, top, central):
+            message = f"{prefix} {size} in {groups} groups, the largest of {largest}."
+            if top and top[0][1]:
+                message += f" Most connected: {top[0][0]} ({top[0][1]}). Most central: {central[0][0]}."
+            self.thread_calls(self.replace_status, placeholder, message)
+
+        self.network.analytics.prepare_in_background(on_ready)
 
     def set_status(self, message):
         self.status_bar.config(text=message)
 
+    def replace_status(self, placeholder, message):
+        #Leaves alone whatever was reported since the placeholder was shown
+        if self.status_bar.cget("text") == placeholder:
+            self.set_status(message)
+
+    @instruments.timed("people_list.refresh")
     def refresh_people_listbox(self, query=""):
-        self.people_listbox.delete(0, tk.END)
-        for person in self.network.nodes:
-            if query.lower() in person.lower():
-                self.people_listbox.insert(tk.END, person)
+        self.people_listbox.set_items(self.people_index.search(query))
 
     def add_person(self):
         name = self.name_entry.get().strip()
@@ -81,21 +135,16 @@ class RelationshipMapper:
             messagebox.showerror("Error", "Name cannot be empty!")
             return
 
-        if name in self.network:
+        if name in self.store:
             messagebox.showwarning("Warning", f"{name} is already in the network.")
             return
 
-        self.network.add_node(name)
-        if name not in self.relationships:
-            self.relationships[name] = {}  #Initialize an empty relationship dictionary
+        self.network.commit_change("add_person", name)
         self.refresh_people_listbox()
         self.name_entry.delete(0, tk.END)
         self.set_status(f"{name} added to the network.")
-        self.save_data()
 
     def rename_person(self):
-        for i in self.relationships:
-            print(i)
         selected = self.people_listbox.curselection()
 
         if not selected:
@@ -103,63 +152,26 @@ class RelationshipMapper:
             return
 
         old_name = self.people_listbox.get(selected)
-
-        check = 0
-        for i in self.relationships:
-            if i==old_name:
-                check = 1
-                break
-        if check == 1:
-            pass
-        elif check != 1:
+        if old_name not in self.store:
             messagebox.showerror("Error", f"Person '{old_name}' does not exist in the network.")
             return
 
-
         new_name = simpledialog.askstring("Rename Person", f"Enter new name for {old_name}:")
         if not new_name:
             messagebox.showwarning("Warning", "No new name provided. Renaming cancelled.")
             return
 
-        newcheck = 0
-        for i in self.relationships:
-            if i==new_name:
-                newcheck = 1
-                break
-        if newcheck == 1:
+        if new_name in self.store:
             messagebox.showerror("Error", f"Person '{new_name}' already exists in the network.")
             return
-        elif newcheck != 1:
-            pass
-
-        #Renames the person in the network
-        self.network = nx.relabel_nodes(self.network, {old_name: new_name})
-
-        #Renames the key in the relationships dictionary
-        self.relationships[new_name] = self.relationships.pop(old_name)
-
-        #Updates relationships for other nodes and checks both directions of the given relationships
-        for person, rels in list(self.relationships.items()):
-            updated_rels = {}
-            for related_person, status in rels.items():
-                if related_person == old_name:
-                    updated_rels[new_name] = status  #Updates old name to new name
-                else:
-                    updated_rels[related_person] = status
-            self.relationships[person] = updated_rels
-
-        #Ensures updated relationships in reverse direction too
-        for u, v, data in self.network.edges(data=True):
-            if u == old_name or v == old_name:
-                status = data["status"]
-                self.network[u][v]["status"] = status  #Updates relationships in the graph
+
+        #Relabels in place, only the renamed person's neighbours are visited
+        self.network.commit_change("rename_person", old_name, new_name)
 
         #Refreshes UI
         self.refresh_people_listbox()
         self.set_status(f"Renamed '{old_name}' to '{new_name}'.")
 
-        self.save_data()
-
     def remove_person(self):
         selected = self.people_listbox.curselection()
         if not selected:
@@ -167,15 +179,14 @@ class RelationshipMapper:
             return
 
         name = self.people_listbox.get(selected)
-        self.network.remove_node(name)
-        del self.relationships[name]
-        for rel in self.relationships.values():
-            if name in rel:
-                del rel[name]
+        if name not in self.store:
+            messagebox.showerror("Error", f"Person '{name}' does not exist in the network.")
+            return
+
+        self.network.commit_change("remove_person", name)
 
         self.refresh_people_listbox()
         self.set_status(f"{name} removed from the network.")
-        self.save_data()
 
     def open_person_gui(self, event):
         selected = self.people_listbox.curselection()
@@ -183,139 +194,54 @@ class RelationshipMapper:
             return
 
         name = self.people_listbox.get(selected)
-        PersonEditor(self.root, name, self.relationships, self.network, self.save_data, self.set_status)
+        PersonEditor(self.root, name, self.store, self.people_index, self.network.analytics,
+                     self.network.commit_change, self.set_status, self.thread_calls)
 
     def search_people(self, event):
+        #Waits for a pause in typing so a burst of keystrokes runs one search
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.run_search)
+
+    def run_search(self):
+        self.search_job = None
         query = self.search_entry.get().strip()
         self.refresh_people_listbox(query)
 
     def generate_map(self):
-        pos = nx.spring_layout(self.network)
-        colors = {
-            "Friend": "green",
-            "Dislike": "red",
-            "Together": "pink",
-            "Exes": "black",
-            "Best Friends": "blue",
-            "Complicated": "orange",
-            "Situationship": "yellow",
-            "Acquaintances": "lightblue",
-            "Likes": "purple",
-            "Distant": "gray"
-        }
-
-        #Creates a figure for the map
-        fig, ax = plt.subplots(figsize=(12, 8))  #Increases width to accommodate the legend
-
-        #Sets the default sizes and colors for all nodes and edges
-        self.node_sizes = {node: 500 for node in self.network.nodes}  #Default size for all nodes
-        self.node_colors = {node: "lightgray" for node in self.network.nodes}  #Default color for all nodes
-        self.edge_widths = [1] * len(self.network.edges())  #Default width for all edges
-        self.edge_colors = [
-            colors.get(data["status"], "black") for u, v, data in self.network.edges(data=True)
-        ]
-
-        #Draws the graph initially with normal relationships and no special selection
-        nx.draw_networkx(self.network, pos, ax=ax, with_labels=True, node_size=list(self.node_sizes.values()),
-                         node_color=list(self.node_colors.values()), edge_color=self.edge_colors,
-                         width=self.edge_widths)
-
-        #Creates axes for the legend outside the connectivity map
-        legend_ax = fig.add_axes([0.85, 0.1, 0.12, 0.8])  #Positions the legend to the right of the graph
-
-        #Adds a semi-transparent legend with colored boxes
-        box_size = 0.02  #Size of the color boxes
-        spacing = 0.04  #Vertical spacing between legend entries
-        legend_x = 0.5  #X-coordinate of the boxes within the legend axis
-        legend_y = 1  #Starting Y-coordinate at the top
-
-        #Turns off the axis of the legend (no ticks or grid)
-        legend_ax.axis('off')
-
-        #Adds colored boxes and their labels in the legend
-        for i, (label, color) in enumerate(colors.items()):
-            #Adds a colored rectangle (legend box)
-            legend_ax.add_patch(plt.Rectangle((legend_x - box_size / 2, legend_y - i * spacing),
-                                              box_size, box_size, color=color))
-
-            #Adds the label next to the color box
-            legend_ax.text(legend_x + box_size / 2 + 0.01, legend_y - i * spacing, label, fontsize=10, va='center')
-
-        #Tracks the currently selected node
-        self.selected_node = None
+        #Imported on first use, so the window opens without waiting for matplotlib
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import Button
+        from mapview import MapView, draw_legend
+
+        with instruments.span("map.generate"):
+            #Reuses the cached layout, only laying out again what changed since the last map
+            pos = self.network.map_positions(self.layout_combobox.get())
+
+            #Creates a figure for the map
+            fig, ax = plt.subplots(figsize=(12, 8))  #Increases width to accommodate the legend
+
+            #Draws the graph initially with normal relationships and no special selection, only what is in view
+            statuses = None if self.map_status_combobox.get() == ALL_STATUSES else [self.map_status_combobox.get()]
+            view = MapView(ax, pos, self.store.edge_table(), statuses)
+
+            #Adds the legend outside the connectivity map
+            draw_legend(fig)
 
         def on_click(event):
-            min_dist = float('inf')
-            closest_node = None
+            #Ignores clicks outside the map, such as on the Reset button
+            if event.inaxes is not ax or event.xdata is None:
+                return
 
-            #Gets current axis limits to preserve zoom and panning
-            xlim, ylim = ax.get_xlim(), ax.get_ylim()
+            #Finds the closest person within the pick radius, clicks on empty space do nothing
+            xlim = ax.get_xlim()
+            radius = PICK_RADIUS_PX * (xlim[1] - xlim[0]) / ax.bbox.width
+            closest_node = view.spatial_index.nearest(event.xdata, event.ydata, radius)
 
-            for node, coord in pos.items():
-                dist = (event.xdata - coord[0]) ** 2 + (event.ydata - coord[1]) ** 2
-                if dist < min_dist:
-                    min_dist = dist
-                    closest_node = node
-
-            if closest_node:
-                if closest_node == self.selected_node:
-                    #Unselects the node without resetting zoom/pan
-                    self.selected_node = None
-                    #Resets node sizes and colors
-                    self.node_sizes = {node: 500 for node in self.network.nodes}
-                    self.node_colors = {node: "lightgray" for node in self.network.nodes}
-                    self.edge_widths = [1] * len(self.network.edges)
-                    self.edge_colors = [colors.get(data["status"], "black") for u, v, data in
-                                        self.network.edges(data=True)]
-
-                    #Resets the relationships for all nodes when the node is unclicked
-                    self.edge_widths = [1] * len(self.network.edges)
-                    self.edge_colors = [colors.get(data["status"], "black") for u, v, data in
-                                        self.network.edges(data=True)]
-
-                else:
-                    #Selects the new node
-                    self.selected_node = closest_node
-                    self.node_sizes = {node: 500 for node in self.network.nodes}
-                    self.node_sizes[closest_node] = 1000
-                    self.node_colors = {node: "lightgray" for node in self.network.nodes}
-                    self.node_colors[closest_node] = "yellow"
-                    self.edge_widths = []
-                    self.edge_colors = []
-                    for u, v, data in self.network.edges(data=True):
-                        if u == closest_node or v == closest_node:
-                            self.edge_widths.append(3)
-                            self.edge_colors.append(colors.get(data["status"], "green"))
-                        else:
-                            self.edge_widths.append(1)
-                            self.edge_colors.append("lightgray")
-
-                #Clears the axis and redraw the network without changing zoom/pan
-                ax.clear()
-                nx.draw_networkx(self.network, pos, ax=ax, with_labels=True, node_size=list(self.node_sizes.values()),
-                                 node_color=list(self.node_colors.values()), edge_color=self.edge_colors,
-                                 width=self.edge_widths)
-
-                #Restores the axis limits (zoom and pan stay the same)
-                ax.set_xlim(xlim)
-                ax.set_ylim(ylim)
-
-                plt.title("Relationship Map")
-                plt.axis("off")
-                plt.draw()
-
-        def reset_graph(ax, pos):
-            self.node_sizes = {node: 500 for node in self.network.nodes}
-            self.node_colors = {node: "lightgray" for node in self.network.nodes}
-            self.edge_widths = [1] * len(self.network.edges())
-            self.edge_colors = [colors.get(data["status"], "black") for u, v, data in self.network.edges(data=True)]
-            ax.clear()
-            nx.draw_networkx(self.network, pos, ax=ax, with_labels=True, node_size=list(self.node_sizes.values()),
-                             node_color=list(self.node_colors.values()), edge_color=self.edge_colors,
-                             width=self.edge_widths)
-            plt.title("Relationship Map")
-            plt.axis("off")
-            plt.draw()
+            if closest_node is not None:
+                #Selects the new node, or unselects it when clicked again, without touching zoom/pan
+                view.select(None if closest_node == view.selected else closest_node)
+                fig.canvas.draw_idle()
 
         fig.canvas.mpl_connect("button_press_event", on_click)
 
@@ -324,8 +250,8 @@ class RelationshipMapper:
         reset_button = Button(reset_ax, 'Reset')
 
         def on_reset(event):
-            self.selected_node = None
-            reset_graph(ax, pos)
+            view.select(None)
+            fig.canvas.draw_idle()
 
         reset_button.on_clicked(on_reset)
 
@@ -359,7 +285,8 @@ class RelationshipMapper:
             ax.set_xlim([x + delta_x * (1 - factor) for x in new_xlim])
             ax.set_ylim([y + delta_y * (1 - factor) for y in new_ylim])
 
-            plt.draw()
+            view.update_view()
+            fig.canvas.draw_idle()
 
         fig.canvas.mpl_connect("scroll_event", on_scroll)
 
@@ -377,8 +304,11 @@ class RelationshipMapper:
                 ax.set_xlim([x - pan_factor for x in xlim])
             elif event.key == 'right':
                 ax.set_xlim([x + pan_factor for x in xlim])
+            else:
+                return
 
-            plt.draw()
+            view.update_view()
+            fig.canvas.draw_idle()
 
         fig.canvas.mpl_connect("key_press_event", on_key)
 
@@ -387,83 +317,140 @@ class RelationshipMapper:
         plt.show()
 
     def export_data(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON Files", "*.json")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=DATA_FILE_TYPES)
         if not file_path:
             return
 
-        nodes = list(self.network.nodes)
-        edges = []
-
-        #Adds relationships in both directions
-        for u, v, data in self.network.edges(data=True):
-            status = data["status"]
-            edges.append([u, v, status])  #Original direction
-            edges.append([v, u, status])  #Reverse direction (both directions)
-
-        #Saves nodes and edges to a JSON file
-        with open(file_path, "w") as f:
-            json.dump({"nodes": nodes, "edges": edges}, f)
+        self.network.export_file(file_path)
 
         self.set_status("Data exported successfully!")
 
     def import_data(self):
-        file_path = filedialog.askopenfilename(filetypes=[("JSON Files", "*.json")])
+        file_path = filedialog.askopenfilename(filetypes=DATA_FILE_TYPES)
         if not file_path:
             return
 
-        with open(file_path, "r") as f:
-            data = json.load(f)
+        merge = messagebox.askyesnocancel("Import Data", "Merge the file into the current network?\n\n"
+                                          "Yes adds its people and relationships, No replaces the network.")
+        if merge is None:
+            return
 
-        self.network.clear()
-        self.relationships.clear()
+        #Reads and validates the file on a worker thread so the window stays responsive, showing progress
+        name = os.path.basename(file_path)
+        self.import_button.config(state=tk.DISABLED)
+        self.set_status(f"Importing {name}...")
 
-        self.network.add_nodes_from(data["nodes"])
-        for u, v, status in data["edges"]:
-            self.network.add_edge(u, v, status=status)
-            if u not in self.relationships:
-                self.relationships[u] = {}
-            self.relationships[u][v] = status
+        def progress(fraction, message):
+            self.thread_calls(self.set_status, f"Importing {name}: {fraction:.0%}. {message}.")
 
-        self.refresh_people_listbox()
-        self.set_status("Data imported successfully!")
-        self.save_data()
-
-    def load_data(self):
-        if os.path.exists(self.data_file):
-            with open(self.data_file, "r") as f:
-                data = json.load(f)
-                self.network.add_nodes_from(data["nodes"])
-                for u, v, status in data["edges"]:
-                    self.network.add_edge(u, v, status=status)
-                    if u not in self.relationships:
-                        self.relationships[u] = {}
-                    self.relationships[u][v] = status
-
-    def save_data(self):
-        nodes = list(self.network.nodes)
-        edges = [(u, v, data["status"]) for u, v, data in self.network.edges(data=True)]
-        with open(self.data_file, "w") as f:
-            json.dump({"nodes": nodes, "edges": edges}, f)
-
-    def start_auto_save(self):
-        def auto_save():
-            while True:
-                self.save_data()
-                threading.Event().wait(self.auto_save_interval)
-
-        threading.Thread(target=auto_save, daemon=True).start()
+        def read():
+            try:
+                data = read_import(file_path, progress=progress)
+            except Exception as e:  #Whatever went wrong, such as a broken worker pool, the import button comes back
+                self.thread_calls(self.import_failed, name, e)
+            else:
+                self.thread_calls(self.finish_import, data, merge)
+
+        threading.Thread(target=read, name="Import", daemon=True).start()
+
+    def finish_import(self, data, merge):
+        #Applied on the Tk thread a batch at a time, so the window redraws between them; the dialog grabs its input,
+        #so nothing is changed or opened meanwhile
+        self.set_status("Applying import...")
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Import Data")
+        dialog.transient(self.root)
+        dialog.protocol("WM_DELETE_WINDOW", lambda: None)  #Stopping halfway would leave half the file applied
+        ttk.Label(dialog, text=f"Applying {data.report.people} people and "
+                               f"{data.report.relationships} relationships...").grid(row=0, column=0, padx=10, pady=5)
+        bar = ttk.Progressbar(dialog, length=300, maximum=1.0)
+        bar.grid(row=1, column=0, padx=10, pady=10)
+        dialog.grab_set()
+        steps = self.network.import_steps(data, merge)
+
+        def step():
+            try:
+                fraction = next(steps)
+            except StopIteration:
+                dialog.destroy()
+                self.import_applied(data.report)
+                return
+            except Exception as e:  #The network has been put back as it was before the import
+                dialog.destroy()
+                self.refresh_people_listbox(self.search_entry.get().strip())
+                self.import_failed(os.path.basename(data.report.path), e)
+                return
+            bar["value"] = fraction
+            self.root.after(1, step)  #Not after(0), which would keep the redraw waiting
+
+        step()
+
+    def import_applied(self, report):
+        self.import_button.config(state=tk.NORMAL)
+        self.refresh_people_listbox(self.search_entry.get().strip())
+        self.show_summary(str(report))
+        if report.problems:
+            messagebox.showwarning("Import Data", "Some records were skipped or reconciled:\n\n"
+                                   + "\n".join(report.problems))
+
+    def import_failed(self, name, error):
+        self.import_button.config(state=tk.NORMAL)
+        self.set_status(f"Import of {name} failed.")
+        messagebox.showerror("Error", f"Nothing was imported.\n\n{error}")
+
+    def import_changes(self):
+        file_path = filedialog.askopenfilename(filetypes=CHANGE_FILE_TYPES)
+        if not file_path:
+            return
+
+        #Applies the whole file as one batch, a single bad row leaves the network untouched
+        try:
+            count = self.network.apply_batch(read_changes(file_path))
+        except BatchError as e:
+            messagebox.showerror("Error", f"No changes were applied.\n\n{e}")
+            return
+
+        self.refresh_people_listbox(self.search_entry.get().strip())
+        self.set_status(f"Applied {count} changes from {os.path.basename(file_path)}.")
+
+    def start_writer(self):
+        #Status updates are handed back to the Tk thread
+        def on_saved(snapshot):
+            message = f"Saved {len(snapshot['nodes'])} people and {len(snapshot['edges'])} relationships."
+            self.thread_calls(self.set_status, message)
+
+        def on_error(error):
+            self.thread_calls(self.set_status, f"Save failed: {error}")
+
+        #Also auto-saves after auto_save_interval seconds without changes
+        self.network.start_writer(on_saved=on_saved, on_error=on_error)
+
+    def open_stats(self):
+        StatsPanel(self.root, self.set_status)
+
+    def on_close(self):
+        if self.network.importing:
+            self.set_status("Closing once the import has been applied...")
+            self.root.after(200, self.on_close)
+            return
+        self.set_status("Saving...")
+        self.network.close()  #Flushes pending changes and writes a final snapshot
+        self.root.destroy()
 
 
 class PersonEditor:
-    def __init__(self, root, name, relationships, network, save_callback, status_callback):
+    @instruments.timed("editor.open")
+    def __init__(self, root, name, store, people_index, analytics, change_callback, status_callback, thread_calls):
         self.root = tk.Toplevel(root)
         self.root.title(f"Edit Relationships for {name}")
         self.name = name
-        self.relationships = relationships
-        self.network = network
-        self.save_callback = save_callback
+        self.store = store
+        self.people_index = people_index  #Shared with the main window and kept up to date by it
+        self.analytics = analytics
+        self.search_job = None
+        self.change_callback = change_callback
         self.status_callback = status_callback
-        self.filtered_people = sorted([person for person in self.network.nodes if person != self.name])  #Sorted list of other people
+        self.thread_calls = thread_calls
 
         self.setup_gui()
 
@@ -471,35 +458,19 @@ class PersonEditor:
         self.relationships_label = ttk.Label(self.root, text=f"Relationships for {self.name}")
         self.relationships_label.grid(row=0, column=0, columnspan=2, pady=10)
 
-        self.relation_frame = ttk.Frame(self.root)
-        self.relation_frame.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
-
-        #Adds scrollable area for relationships
-        self.canvas = tk.Canvas(self.relation_frame, height=200)  #Set desired height
-        self.scrollbar = ttk.Scrollbar(self.relation_frame, orient="vertical", command=self.canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.canvas)
-
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        )
-
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-
-        self.canvas.grid(row=0, column=0, sticky="nsew")
-        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        #Adds scrollable area for relationships, only the visible rows are ever created
+        self.relations_list = VirtualListbox(self.root, height=10, formatter=lambda item: f"{item[0]}: {item[1]}")
+        self.relations_list.grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky="ew")
 
         #Inputs fields for adding relationships
         self.relation_combobox = ttk.Combobox(self.root, state="normal")
         self.relation_combobox.grid(row=2, column=0, padx=5, pady=5)
-        self.relation_combobox.bind("<KeyRelease>", self.update_relation_combobox)
+        self.relation_combobox.bind("<KeyRelease>", self.schedule_relation_combobox)
         self.update_relation_combobox()  #Initializes the dropdown
 
         self.status_combobox = ttk.Combobox(
             self.root,
-            values=["Friend", "Dislike", "Together", "Exes", "Best Friends",
-                    "Complicated", "Situationship", "Acquaintances", "Likes", "Distant"],
+            values=list(RELATIONSHIP_STATUSES),
             state="readonly"
         )
         self.status_combobox.grid(row=2, column=1, padx=5, pady=5)
@@ -508,33 +479,80 @@ class PersonEditor:
                                               command=self.add_or_update_relationship)
         self.add_relation_button.grid(row=3, column=0, columnspan=2, pady=5)
 
+        #Finds how this person is connected to the one picked above
+        self.friends_only = tk.BooleanVar(value=False)
+        self.friends_only_check = ttk.Checkbutton(self.root, text="Only through friends", variable=self.friends_only)
+        self.friends_only_check.grid(row=4, column=0, padx=5, pady=5)
+        self.path_button = ttk.Button(self.root, text="Find Connection", command=self.find_connection)
+        self.path_button.grid(row=4, column=1, padx=5, pady=5)
+
+        self.summary_label = ttk.Label(self.root, text="")
+        self.summary_label.grid(row=5, column=0, columnspan=2, padx=5, pady=5)
+
         self.refresh_relations()
 
+    def schedule_relation_combobox(self, event=None):
+        #Waits for a pause in typing so a burst of keystrokes runs one search
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.update_relation_combobox)
+
+    @instruments.timed("editor.search")
     def update_relation_combobox(self, event=None):
         """Update the combobox dropdown with filtered values based on user input."""
-        query = self.relation_combobox.get().lower()  #Gets current input
-        self.filtered_people = [person for person in self.network.nodes if person != self.name and query in person.lower()]
+        self.search_job = None
+        query = self.relation_combobox.get()  #Gets current input
+        matches = self.people_index.search(query, limit=COMBOBOX_LIMIT + 1)
+        self.filtered_people = [person for person in matches if person != self.name][:COMBOBOX_LIMIT]
         self.relation_combobox['values'] = self.filtered_people
 
+    @instruments.timed("editor.refresh")
     def refresh_relations(self):
-        #Clears the existing relations
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-
-        #Gets all relationships for the selected person
-        all_relations = self.relationships.get(self.name, {})
-
-        for person, relation in all_relations.items():
-            label = ttk.Label(self.scrollable_frame, text=f"{person}: {relation}")
-            label.grid(sticky="w", padx=5, pady=2)
+        #Gets all relationships for the selected person, whichever side they were added from
+        relations = list(self.store.relations(self.name).items())
+        self.relation_rows = {person: row for row, (person, _) in enumerate(relations)}
+        self.relations_list.set_items(relations)
+        self.refresh_summary()
+
+    def refresh_summary(self):
+        counts = self.analytics.status_degree(self.name)
+        by_status = ", ".join(f"{status} {count}" for status, count in counts.most_common())
+        if self.name not in self.store:
+            group = "in a group of 1 person"
+        elif self.analytics.components_ready():
+            group = f"in a group of {self.analytics.component_size(self.name)} people"
+        else:
+            #Groups are labelled again after a removal, off the Tk thread, the label is filled in once they are
+            group = "counting their group..."
+            self.analytics.prepare_in_background(lambda *results: self.thread_calls(self.groups_ready))
+        self.summary_label.config(text=f"{sum(counts.values())} relationships ({by_status or 'none'}), {group}")
+
+    def groups_ready(self):
+        if self.root.winfo_exists():
+            self.refresh_summary()
+
+    def find_connection(self):
+        person = self.relation_combobox.get().strip()
+        if person not in self.store:
+            messagebox.showerror("Error", f"{person or 'Nobody'} is not in the network!")
+            return
 
-        #Includes relationships for the selected person that involve others
-        for person in self.filtered_people:
-            if person != self.name:
-                for related_person, relation in self.relationships.get(person, {}).items():
-                    if related_person == self.name:
-                        label = ttk.Label(self.scrollable_frame, text=f"{person}: {relation}")
-                        label.grid(sticky="w", padx=5, pady=2)
+        statuses = FRIENDLY_STATUSES if self.friends_only.get() else None
+        path = self.analytics.shortest_path(self.name, person, statuses)
+        if path is None:
+            self.status_callback(f"{self.name} and {person} are not connected"
+                                 + (" through friends." if statuses else "."))
+        else:
+            self.status_callback(f"{len(path) - 1} steps: " + " -> ".join(path))
+
+    def show_relation(self, person, status):
+        #Updates the one affected row instead of rebuilding the list
+        row = self.relation_rows.get(person)
+        if row is None:
+            self.relation_rows[person] = len(self.relations_list.items)
+            self.relations_list.append_item((person, status))
+        else:
+            self.relations_list.update_item(row, (person, status))
 
     def add_or_update_relationship(self):
         person = self.relation_combobox.get().strip()
@@ -543,32 +561,131 @@ class PersonEditor:
             messagebox.showerror("Error", "Both person and status must be selected!")
             return
 
-        if person not in self.network.nodes:
+        if person not in self.store:
             messagebox.showerror("Error", f"{person} does not exist in the network!")
             return
 
-        if self.name not in self.relationships:
-            self.relationships[self.name] = {}
-        self.relationships[self.name][person] = status
-
-        self.network.add_edge(self.name, person, status=status)
-        self.refresh_relations()
-        self.save_callback()
+        self.change_callback("set_relationship", self.name, person, status)
+        self.show_relation(person, status)
+        self.refresh_summary()
         self.status_callback(f"Relationship with {person} ({status}) updated!")
 
     def remove_relationship(self, person):
-        del self.relationships[self.name][person]
-        if not self.relationships[self.name]:
-            del self.relationships[self.name]
-        self.network.remove_edge(self.name, person)
+        self.change_callback("remove_relationship", self.name, person)
         self.refresh_relations()
-        self.save_callback()
         self.status_callback(f"Relationship with {person} removed.")
 
 
+class StatsPanel:
+    """Live timings and counters from the instruments, with the trace export and the profiling toggles."""
+
+    def __init__(self, root, status_callback):
+        self.root = tk.Toplevel(root)
+        self.root.title("Performance")
+        self.status_callback = status_callback
+        self.refresh_job = None
+
+        self.setup_gui()
+        self.root.bind("<Destroy>", self.on_destroy)
+
+    def setup_gui(self):
+        #Recording is off by default, so the instruments cost next to nothing until asked for
+        self.recording = tk.BooleanVar(value=instruments.enabled)
+        self.recording_check = ttk.Checkbutton(self.root, text="Record timings", variable=self.recording,
+                                               command=self.toggle_recording)
+        self.recording_check.grid(row=0, column=0, padx=5, pady=5, sticky="w")
+
+        columns = ("calls", "total", "mean", "longest")
+        self.table = ttk.Treeview(self.root, columns=columns, height=14)
+        self.table.heading("#0", text="Operation")
+        for column, heading in zip(columns, ("Calls", "Total ms", "Mean ms", "Longest ms")):
+            self.table.heading(column, text=heading)
+            self.table.column(column, width=90, anchor="e")
+        self.table.grid(row=1, column=0, columnspan=4, padx=5, pady=5, sticky="nsew")
+
+        self.reset_button = ttk.Button(self.root, text="Reset", command=self.reset)
+        self.reset_button.grid(row=2, column=0, padx=5, pady=5)
+        self.trace_button = ttk.Button(self.root, text="Export Trace", command=self.export_trace)
+        self.trace_button.grid(row=2, column=1, padx=5, pady=5)
+        self.profile_button = ttk.Button(self.root, command=self.toggle_profile)
+        self.profile_button.grid(row=2, column=2, padx=5, pady=5)
+        self.memory_button = ttk.Button(self.root, command=self.toggle_memory)
+        self.memory_button.grid(row=2, column=3, padx=5, pady=5)
+
+        #cProfile and tracemalloc reports
+        self.report = tk.Text(self.root, height=12, width=100, wrap="none")
+        self.report.grid(row=3, column=0, columnspan=4, padx=5, pady=5, sticky="nsew")
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(3, weight=1)
+
+        self.refresh()
+
+    def refresh(self):
+        self.refresh_job = None
+        self.table.delete(*self.table.get_children())
+        for name, calls, total, mean, longest in instruments.summary():
+            self.table.insert("", tk.END, text=name, values=(calls, f"{total:.1f}", f"{mean:.2f}", f"{longest:.1f}"))
+        for name, total in sorted(instruments.counters.items()):
+            self.table.insert("", tk.END, text=name, values=(total, "", "", ""))
+        self.profile_button.config(text="Stop Profile" if instruments.profiling else "Start Profile")
+        self.memory_button.config(text="Stop Memory Trace" if instruments.tracing_memory else "Start Memory Trace")
+        self.refresh_job = self.root.after(STATS_REFRESH_MS, self.refresh)
+
+    def toggle_recording(self):
+        if self.recording.get():
+            instruments.enable()
+        else:
+            instruments.disable()
+
+    def reset(self):
+        instruments.reset()
+        self.refresh_after_change()
+
+    def export_trace(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=TRACE_FILE_TYPES)
+        if not file_path:
+            return
+
+        instruments.export_chrome_trace(file_path)
+        self.status_callback(f"Trace written to {os.path.basename(file_path)}, open it in chrome://tracing.")
+
+    def toggle_profile(self):
+        if not instruments.profiling:
+            instruments.start_profile()
+            self.status_callback("Profiling, stop the profile to see where the time went.")
+        else:
+            #The capture is always shown, saving it for snakeviz or pstats is optional
+            file_path = filedialog.asksaveasfilename(defaultextension=".prof", filetypes=PROFILE_FILE_TYPES)
+            self.show_report(instruments.stop_profile(file_path or None))
+        self.refresh_after_change()
+
+    def toggle_memory(self):
+        if not instruments.tracing_memory:
+            instruments.start_memory()
+            self.status_callback("Tracing memory, stop the trace to see what holds the most.")
+        else:
+            self.show_report(instruments.stop_memory())
+        self.refresh_after_change()
+
+    def show_report(self, text):
+        self.report.delete("1.0", tk.END)
+        self.report.insert("1.0", text)
+
+    def refresh_after_change(self):
+        if self.refresh_job is not None:
+            self.root.after_cancel(self.refresh_job)
+        self.refresh()
+
+    def on_destroy(self, event):
+        #<Destroy> also fires for every child widget, only the window itself stops the refreshes
+        if event.widget is self.root and self.refresh_job is not None:
+            self.root.after_cancel(self.refresh_job)
+            self.refresh_job = None
+
+
 if __name__ == "__main__":
     root = tk.Tk()
-    app = RelationshipMapper(root)
+    app = RelationshipMapper(root, *sys.argv[1:2])
     root.mainloop()
 
 
@@ -0,0 +1,452 @@
+"""The relationship network without a GUI, for scripts, services and the Tk front end alike.
+
+Importing this module does not pull in tkinter, matplotlib, networkx or
+numpy; they are only imported by the operations that need them, such as
+laying out a map or reading a binary snapshot.
+
+    network = RelationshipNetwork("relationships.json")
+    network.load()
+    network.commit_change("set_relationship", "Alice", "Bob", "Friend")
+    network.save()
+"""
+import os
+import threading
+
+from analytics import NetworkAnalytics
+from instrument import instruments
+from layout import LayoutCache
+from persistence import (BARRIER, RELATIONSHIP_STATUSES, SQLITE_EXTENSIONS, BackgroundWriter, ChangeJournal,
+                         SaveCoordinator, export_records, load_file)
+from search import PeopleIndex
+from store import RelationshipStore, RelationshipsView
+
+CHANGE_ARITY = {"add_person": 1, "rename_person": 2, "remove_person": 1, "set_relationship": 3,
+                "remove_relationship": 2}
+BATCH_REINDEX_LIMIT = 1000  #Largest batch that updates the search index change by change instead of rebuilding it
+BATCH_SAVE_SIZE = 1000  #Smallest batch that is followed by a snapshot, as many single changes would have been
+IMPORT_BATCH_SIZE = 5000  #People or relationships applied by each step of an import
+
+
+class BatchError(ValueError):
+    """A change in a batch that could not be applied. None of the batch was kept."""
+
+    def __init__(self, position, change, message):
+        super().__init__(f"Change {position + 1} {list(change)!r}: {message}")
+        self.position = position  #Index of the change in the batch
+        self.change = change
+
+
+def validate_changes(changes):
+    """Returns changes as (op, args) pairs, raising BatchError for the first one that is malformed.
+
+    Only the shape of each change is checked here, whether it fits the network
+    is checked as the batch is applied.
+    """
+    validated = []
+    for position, change in enumerate(changes):
+        if isinstance(change, str) or not change:
+            raise BatchError(position, (change,), "expected (op, *args)")
+        op, *args = change
+        if op not in CHANGE_ARITY:
+            raise BatchError(position, change, f"unknown change {op!r}")
+        if len(args) != CHANGE_ARITY[op]:
+            raise BatchError(position, change, f"{op} takes {CHANGE_ARITY[op]} arguments, got {len(args)}")
+        names = args[:2] if op == "set_relationship" else args
+        if not all(isinstance(name, str) and name.strip() for name in names):
+            raise BatchError(position, change, "names cannot be empty")
+        if op == "set_relationship" and args[2] not in RELATIONSHIP_STATUSES:
+            raise BatchError(position, change, f"unknown status {args[2]!r}")
+        validated.append((op, tuple(args)))
+    return validated
+
+
+class SnapshotBackend:
+    """Keeps a RelationshipNetwork in memory, backed by a data file and a journal of the changes since it was written.
+
+    Changes are journaled as they are made, synchronously or, once
+    start_writer has been called, on the background writer thread. save
+    writes a snapshot and compacts the journal it covers; a snapshot asked
+    for with request_save is written on the writer thread or, without one,
+    before request_save returns.
+    """
+
+    def __init__(self, data_file, lock, read_only=False):
+        self.store = RelationshipStore()
+        self.read_only = read_only  #Loads without truncating the journal, see RelationshipNetwork
+        self.people_index = PeopleIndex()
+        self.data_file = data_file  #A .rmap path switches to the binary snapshot format
+        self.journal = ChangeJournal(os.path.splitext(data_file)[0] + ".journal")
+        self.saver = SaveCoordinator(data_file, lock)
+        self.writer = None
+
+    def load(self):
+        """Loads the data file into the store and returns (positions, changes to replay)."""
+        snapshot_seq = 0
+        positions = {}
+        if os.path.exists(self.data_file):
+            extra = load_file(self.store, self.data_file)
+            snapshot_seq = extra.get("seq", 0)
+            positions = extra.get("positions", {})
+        return positions, self.journal.replay(snapshot_seq, truncate=not self.read_only)
+
+    def record(self, op, args):
+        """Journals a change just applied, under the lock. Returns a function to call once the lock is released, or None."""
+        seq = self.journal.next_seq()
+        self.saver.mark_dirty()
+        if self.writer is None:
+            self.journal.write([(seq, op, args)])
+            return None
+        return lambda: self.writer.append(seq, op, *args)
+
+    def rolled_back(self):
+        pass
+
+    def mark_dirty(self):
+        self.saver.mark_dirty()
+
+    def imported(self):
+        """Journals a barrier after an import, under the lock, so replay never applies later changes to the old snapshot.
+
+        Returns a function to call once the lock is released, or None.
+        """
+        return self.record(BARRIER, ())
+
+    def import_abandoned(self, network):
+        """Empties the store after an import stopped partway, for network.load to read it again as it was before.
+
+        Nothing of the import was journaled or saved, so the data file and the
+        journal still hold the network from before it, once the writer has
+        written what was queued.
+        """
+        if self.writer is not None:
+            self.writer.flush()
+        with network.lock:
+            self.store.clear()
+
+    def request_save(self, network):
+        if self.writer is not None:
+            self.writer.request_save()
+        else:
+            self.save(network)
+
+    def save(self, network):
+        snapshot = self.saver.save(network.take_snapshot)
+        if snapshot is not None:
+            #The snapshot now covers every journal entry up to its seq
+            with network.lock:
+                self.journal.compact(snapshot["seq"])
+        return snapshot
+
+    def start_writer(self, network, on_saved=None, on_error=None):
+        self.writer = BackgroundWriter(self.journal, network.save, on_saved=on_saved, on_error=on_error,
+                                       interval=network.auto_save_interval)
+
+    def close(self, network):
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            self.save(network)
+            self.journal.close()
+
+
+class RelationshipNetwork:
+    """The people and their relationships, with the search index and map layout kept in step, backed by a data file.
+
+    Every change goes through commit_change, which applies it under the lock
+    and hands it to the storage backend: a SnapshotBackend journaling changes
+    on top of a .json, .jsonl or .rmap snapshot, or, for a .db, .sqlite or
+    .sqlite3 file, a SqliteBackend committing them to the database. A
+    read_only network is only loaded to be read, such as by render.py while
+    the app has the file open: its journal is replayed but left untouched,
+    a database is opened read-only, and it must not be changed or saved.
+    """
+
+    def __init__(self, data_file="relationships.json", auto_save_interval=300, read_only=False):
+        self.data_file = data_file
+        self.auto_save_interval = auto_save_interval  #Auto-saves after this many seconds without changes
+        self.lock = threading.RLock()  #Guards the network against the writer thread
+        if data_file.lower().endswith(SQLITE_EXTENSIONS):
+            from sqlstore import SqliteBackend  #Deferred, only databases need sqlite3
+
+            self.backend = SqliteBackend(data_file, read_only)
+        else:
+            self.backend = SnapshotBackend(data_file, self.lock, read_only)
+        self.store = self.backend.store
+        self.people_index = self.backend.people_index
+        self.layout = LayoutCache()
+        self.analytics = NetworkAnalytics(self.store, self.lock)
+        self.importing = False  #Set while import_steps is applying a file
+
+    @instruments.timed("network.load")
+    def load(self):
+        positions, changes = self.backend.load()
+        self.layout.load(positions, self.store)
+        self.people_index.rebuild(self.store.people())
+        self.analytics.reset()
+
+        #Replays the changes made since the snapshot was written
+        for op, args in changes:
+            self._apply_change(op, args)
+            self.backend.mark_dirty()
+
+    @instruments.timed("network.save")
+    def save(self):
+        return self.backend.save(self)
+
+    def take_snapshot(self):
+        #Called under the lock, only freezing the store happens there; the snapshot is read from the frozen copy after
+        if self.importing:
+            return None  #Half an import is never saved, the last step asks for a snapshot
+        frozen = self.store.freeze()
+        positions = dict(self.layout.positions)
+        return {"nodes": frozen.people(), "edges": RelationshipsView(frozen), "seq": self.backend.journal.seq,
+                "positions": positions}
+
+    def import_file(self, path, merge=False, strict=False, progress=None, processes=None):
+        """Imports a data file, replacing the network or, with merge, adding to it. Returns an ImportReport.
+
+        The whole file is read, validated and deduplicated first, see
+        importer.read_import for strict, progress and processes, and only then
+        applied with apply_import.
+        """
+        from importer import read_import  #Deferred, only imports need the worker pool
+
+        return self.apply_import(read_import(path, strict, progress, processes), merge)
+
+    @instruments.timed("network.import")
+    def apply_import(self, data, merge=False):
+        """Applies ImportData from importer.read_import, returning its report with what changed filled in.
+
+        Reading can happen on any thread, without the lock; only this holds it.
+        When merging, a relationship already in the network takes the file's
+        status. See import_steps to apply it a batch at a time.
+        """
+        for _ in self.import_steps(data, merge):
+            pass
+        return data.report
+
+    def import_steps(self, data, merge=False):
+        """Applies ImportData like apply_import, a batch at a time, yielding the fraction done after each.
+
+        The lock is only held for one batch, so a GUI can run between them.
+        Until the last step no snapshot is written and nothing is journaled,
+        so a crash partway recovers the network from before the import. If a
+        step fails, or the steps are not run to the end, the network is put
+        back as it was before too.
+        """
+        report = data.report
+        finished = False
+        with self.lock:
+            self.importing = True
+            if not merge:
+                self.store.clear()
+                self.layout.clear()
+        try:
+            people = [name for name in data.names if name not in self.store] if merge else data.names
+            relationships = list(data.relationships.items())
+            total = len(people) + len(relationships) + 2 * IMPORT_BATCH_SIZE  #The last two steps count as batches
+            for start in range(0, len(people), IMPORT_BATCH_SIZE):
+                with self.lock:
+                    self.store.add_people(people[start:start + IMPORT_BATCH_SIZE])
+                yield (start + IMPORT_BATCH_SIZE) / total
+            report.people_added = len(people)
+
+            touched = set()
+            for start in range(0, len(relationships), IMPORT_BATCH_SIZE):
+                with self.lock:
+                    changes = []
+                    for (u, v), status in relationships[start:start + IMPORT_BATCH_SIZE]:
+                        previous = self.store.status(u, v) if merge else None
+                        if previous is None:
+                            report.relationships_added += 1
+                        elif previous != status:
+                            report.relationships_updated += 1
+                        else:
+                            continue
+                        changes.append((u, v, status))
+                    self.store.add_relationships(changes)
+                if merge:
+                    touched.update(name for u, v, _ in changes for name in (u, v))
+                yield (len(people) + start + IMPORT_BATCH_SIZE) / total
+
+            with self.lock:
+                self.people_index.rebuild(self.store.people())
+            yield (total - IMPORT_BATCH_SIZE) / total
+
+            with self.lock:
+                self.layout.place(data.positions, self.store)
+                if merge:
+                    self.layout.touch(*touched)
+                self.analytics.reset()
+                self.importing = False
+                after = self.backend.imported()
+            finished = True
+        finally:
+            if not finished:
+                self._abandon_import()  #Failed, or the steps were abandoned partway
+        if after is not None:
+            after()
+        self.backend.request_save(self)  #Until this snapshot is written a crash recovers the network from before the import
+        yield 1.0
+
+    def _abandon_import(self):
+        self.backend.import_abandoned(self)
+        with self.lock:
+            self.load()
+            self.importing = False
+
+    @instruments.timed("network.export")
+    def export_file(self, path):
+        #Streams each relationship once, the network is undirected so importing restores both directions
+        export_records(path, self.store.people(), self.store.relationships())
+
+    @instruments.timed("map.layout")
+    def map_positions(self, engine="auto"):
+        """Returns {name: (x, y)} for everyone, only laying out again what changed since the last map."""
+        network = self.store.to_networkx()
+        if not self.layout.is_current(network):
+            positions = self.layout.compute(network, engine)
+            with self.lock:
+                self.layout.update(positions)
+                self.backend.mark_dirty()  #Saves the new positions with the next snapshot
+        return dict(self.layout.positions)
+
+    @instruments.timed("network.change")
+    def commit_change(self, op, *args):
+        """Applies a single change and records it with the backend."""
+        with self.lock:
+            self._apply_change(op, args)
+            after = self.backend.record(op, args)
+        if after is not None:
+            after()
+
+    @instruments.timed("network.batch")
+    def apply_batch(self, changes):
+        """Applies many changes as one, all of them or, if any of them fails, none. Returns how many were applied.
+
+        The changes are (op, *args) tuples as taken by commit_change. Their
+        shape is validated before anything is touched; each one is then checked
+        against the network as it is applied, and the first that does not fit
+        (adding someone already there, removing someone who is not, ...) undoes
+        the ones before it and raises BatchError. Large batches rebuild the
+        search index once at the end, and the batch is recorded as a single
+        journal entry or database transaction, so a crash never leaves half
+        of it behind.
+        """
+        changes = validate_changes(changes)
+        if not changes:
+            return 0
+
+        reindex = len(changes) <= BATCH_REINDEX_LIMIT
+        with self.lock:
+            undo = []
+            try:
+                for position, (op, args) in enumerate(changes):
+                    undo.append(self._undo_for(position, op, args))
+                    self._apply_change(op, args, reindex)
+            except Exception:
+                for undo_changes in reversed(undo):
+                    for op, args in undo_changes:
+                        self._apply_change(op, args, reindex)
+                if not reindex:
+                    self.people_index.rebuild(self.store.people())
+                self.backend.rolled_back()
+                raise
+
+            if not reindex:
+                self.people_index.rebuild(self.store.people())
+            after = self.backend.record("batch", ([[op, *args] for op, args in changes],))
+        if after is not None:
+            after()
+        if len(changes) >= BATCH_SAVE_SIZE:
+            self.backend.request_save(self)  #A journal counts the batch as one entry
+        return len(changes)
+
+    def _undo_for(self, position, op, args):
+        """Checks that a batched change fits the network and returns the changes that would undo it."""
+        change = (op, *args)
+        if op == "add_person":
+            name, = args
+            if name in self.store:
+                raise BatchError(position, change, f"{name} is already in the network")
+            return [("remove_person", (name,))]
+        if op == "rename_person":
+            old_name, new_name = args
+            if old_name not in self.store:
+                raise BatchError(position, change, f"{old_name} is not in the network")
+            if new_name in self.store:
+                raise BatchError(position, change, f"{new_name} is already in the network")
+            return [("rename_person", (new_name, old_name))]
+        if op == "remove_person":
+            name, = args
+            if name not in self.store:
+                raise BatchError(position, change, f"{name} is not in the network")
+            return [("add_person", (name,))] + [("set_relationship", (name, other, status))
+                                                for other, status in self.store.relations(name).items()]
+        if op == "set_relationship":
+            u, v, _ = args
+            previous = self.store.status(u, v)
+            if previous is not None:
+                return [("set_relationship", (u, v, previous))]
+            new_people = [name for name in dict.fromkeys((u, v)) if name not in self.store]
+            return [("remove_relationship", (u, v))] + [("remove_person", (name,)) for name in new_people]
+        u, v = args
+        previous = self.store.status(u, v)
+        if previous is None:
+            raise BatchError(position, change, f"{u} and {v} have no relationship")
+        return [("set_relationship", (u, v, previous))]
+
+    def _apply_change(self, op, args, reindex=True):
+        #Keeps the search index, cached map layout and analytics in step with the store
+        if op == "add_person":
+            name, = args
+            if name not in self.store:
+                self.store.add_person(name)
+                if reindex:
+                    self.people_index.add(name)
+                self.layout.touch(name)
+                self.analytics.person_added(name)
+        elif op == "rename_person":
+            if self.store.rename_person(*args):
+                if reindex:
+                    self.people_index.rename(*args)
+                self.layout.rename(*args)
+                self.analytics.person_renamed(*args)
+        elif op == "remove_person":
+            name, = args
+            self.layout.touch(*self.store.relations(name))
+            if self.store.remove_person(name):
+                if reindex:
+                    self.people_index.remove(name)
+                self.layout.remove(name)
+                self.analytics.person_removed(name)
+        elif op == "set_relationship":
+            u, v, status = args
+            new_people = [name for name in dict.fromkeys((u, v)) if name not in self.store]
+            is_new = self.store.status(u, v) is None
+            self.store.set_relationship(u, v, status)
+            for name in new_people:
+                if reindex:
+                    self.people_index.add(name)
+                self.analytics.person_added(name)
+            if is_new:
+                self.layout.touch(u, v)
+                self.analytics.relationship_added(u, v)
+            else:
+                self.analytics.relationship_changed(u, v)
+        elif op == "remove_relationship":
+            if self.store.remove_relationship(*args):
+                self.layout.touch(*args)
+                self.analytics.relationship_removed(*args)
+        elif op == "batch":
+            entries, = args
+            for op, *args in entries:
+                self._apply_change(op, args, reindex)
+
+    def start_writer(self, on_saved=None, on_error=None):
+        """Moves journal writes and snapshots onto a background thread, which also auto-saves when idle."""
+        self.backend.start_writer(self, on_saved=on_saved, on_error=on_error)
+
+    def close(self):
+        """Writes pending changes and a final snapshot."""
+        self.backend.close(self)
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+MAX_GRID_SIZE = 48  #Most cells per side of the grid approximating repulsion in the force engine
+CHUNK_SIZE = 512  #Points whose repulsion is computed at once
+
+
+def force_directed_layout(nodes, edges, start, moving=None, iterations=50):
+    """Fruchterman-Reingold layout vectorized with NumPy for large networks.
+
+    Repulsion is approximated Barnes-Hut style on a grid: distant people only
+    feel the centre of mass of each occupied cell, and each person is pushed
+    away from the centre of their own cell, so an iteration costs
+    O(cells ** 2 + nodes + edges) instead of O(nodes ** 2). Only the nodes in
+    moving are moved, or all of them if moving is None, in which case the
+    result is rescaled to [-1, 1] like spring_layout. With few nodes moving the
+    grid is built once and only their own relationships are followed.
+    """
+    n = len(nodes)
+    grid_size = int(min(MAX_GRID_SIZE, max(4, math.sqrt(n / 4))))
+    index = {name: i for i, name in enumerate(nodes)}
+    xy = np.array([start[name] for name in nodes], dtype=float)
+    edge_list = list(edges)
+    src = np.fromiter((index[u] for u, _ in edge_list), dtype=np.intp, count=len(edge_list))
+    dst = np.fromiter((index[v] for _, v in edge_list), dtype=np.intp, count=len(edge_list))
+    if moving is None:
+        movers = np.arange(n)
+    else:
+        movers = np.array(sorted(index[name] for name in moving), dtype=np.intp)
+        is_mover = np.zeros(n, dtype=bool)
+        is_mover[movers] = True
+        incident = is_mover[src] | is_mover[dst]
+        src, dst = src[incident], dst[incident]
+    if not len(movers):
+        return dict(zip(nodes, map(tuple, xy.tolist())))
+
+    k = math.sqrt(1.0 / n)  #Ideal distance between nodes
+    t = 0.1 * max(np.ptp(xy[:, 0]), np.ptp(xy[:, 1]), 0.1)  #Temperature, the largest step a node can take
+    dt = t / (iterations + 1)
+    grid = None
+
+    for _ in range(iterations):
+        if moving is None:
+            cell_ids, masses, centres, cell_rows = _cell_grid(xy, grid_size)
+            #Far field, every cell pushed by every other cell's mass
+            cell_force = _repulsion(centres, centres, masses, k)
+            #Near field, every person pushed away from the rest of their own cell
+            own = cell_rows[cell_ids]
+            delta = xy - centres[own]
+            dist2 = np.maximum((delta ** 2).sum(axis=1), (0.01 * k) ** 2)
+            displacement = cell_force[own] + delta * ((masses[own] - 1) * k * k / dist2)[:, None]
+        else:
+            #Everyone else stays put, so the grid only has to be built once
+            if grid is None:
+                grid = _cell_grid(xy, grid_size)
+            _, masses, centres, _ = grid
+            displacement = _repulsion(xy[movers], centres, masses, k)
+
+        #Pulls related people together, summing each edge's pull onto both ends
+        delta = xy[src] - xy[dst]
+        dist = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), 0.01 * k)
+        pull = delta * (dist / k)[:, None]
+        attraction = np.column_stack([np.bincount(dst, weights=pull[:, axis], minlength=n)
+                                      - np.bincount(src, weights=pull[:, axis], minlength=n) for axis in (0, 1)])
+        displacement += attraction[movers]
+
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 1e-9)
+        xy[movers] += displacement * (np.minimum(length, t) / length)[:, None]
+        t -= dt
+
+    if moving is None:
+        xy -= xy.mean(axis=0)
+        xy /= max(np.abs(xy).max(), 1e-9)
+    return dict(zip(nodes, map(tuple, xy.tolist())))
+
+
+def _cell_grid(xy, grid_size):
+    """Bins points into a grid, returning each point's cell id plus the mass and centre of mass of the occupied cells."""
+    low = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - low, 1e-9)
+    cells = np.minimum(((xy - low) / span * grid_size).astype(np.intp), grid_size - 1)
+    cell_ids = cells[:, 0] * grid_size + cells[:, 1]
+    mass = np.bincount(cell_ids, minlength=grid_size * grid_size)
+    occupied = mass > 0
+    masses = mass[occupied].astype(float)
+    centres = np.column_stack([np.bincount(cell_ids, weights=xy[:, axis], minlength=len(mass))[occupied]
+                               for axis in (0, 1)])
+    centres /= masses[:, None]
+    cell_rows = np.cumsum(occupied) - 1  #Cell id -> row in centres
+    return cell_ids, masses, centres, cell_rows
+
+
+def _repulsion(points, centres, masses, k):
+    force = np.zeros_like(points)
+    for chunk_start in range(0, len(points), CHUNK_SIZE):
+        chunk = slice(chunk_start, chunk_start + CHUNK_SIZE)
+        delta = points[chunk][:, None, :] - centres[None, :, :]
+        dist2 = np.maximum((delta ** 2).sum(axis=2), (0.01 * k) ** 2)
+        force[chunk] = np.einsum("ijk,ij->ik", delta, masses * k * k / dist2)
+    return force
+
+
+class SpatialIndex:
+    """Uniform grid over map positions for nearest-person and rectangle lookups.
+
+    Points are bucketed into cells of about two points each, stored CSR style
+    as one array of point indexes sorted by cell plus the offset where each
+    cell starts, so a lookup only measures the points in the cells it covers.
+    """
+
+    def __init__(self, names, xy):
+        self.names = list(names)
+        self.xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        self.grid_size = max(1, int(math.sqrt(len(self.names) / 2)))
+        if len(self.names):
+            self.low = self.xy.min(axis=0)
+            self.cell_size = np.maximum(self.xy.max(axis=0) - self.low, 1e-9) / self.grid_size
+        else:
+            self.low = np.zeros(2)
+            self.cell_size = np.ones(2)
+
+        cells = self._cells(self.xy)
+        cell_ids = cells[:, 0] * self.grid_size + cells[:, 1]
+        self.order = np.argsort(cell_ids, kind="stable")
+        self.cell_starts = np.searchsorted(cell_ids[self.order], np.arange(self.grid_size * self.grid_size + 1))
+
+    @classmethod
+    def from_positions(cls, positions):
+        names = list(positions)
+        return cls(names, [positions[name] for name in names])
+
+    def _cells(self, xy):
+        return np.clip(((xy - self.low) / self.cell_size).astype(np.intp), 0, self.grid_size - 1)
+
+    def within(self, xmin, xmax, ymin, ymax):
+        """Returns the indexes of the points inside the rectangle."""
+        (col0, row0), (col1, row1) = self._cells(np.array([[xmin, ymin], [xmax, ymax]]))
+        candidates = [self.order[self.cell_starts[col * self.grid_size + row0]:
+                                 self.cell_starts[col * self.grid_size + row1 + 1]]
+                      for col in range(col0, col1 + 1)]
+        if not candidates:
+            return np.empty(0, dtype=np.intp)
+        candidates = np.concatenate(candidates)
+        x, y = self.xy[candidates, 0], self.xy[candidates, 1]
+        return candidates[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]
+
+    def nearest(self, x, y, radius):
+        """Returns the name of the closest point within radius of (x, y), or None if there is none."""
+        candidates = self.within(x - radius, x + radius, y - radius, y + radius)
+        if not len(candidates):
+            return None
+        dist2 = ((self.xy[candidates] - (x, y)) ** 2).sum(axis=1)
+        best = np.argmin(dist2)
+        if dist2[best] > radius * radius:
+            return None
+        return self.names[candidates[best]]
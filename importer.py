@@ -0,0 +1,402 @@
+"""Validated, deduplicated imports of data files, in chunks and, for large JSON Lines files, across worker processes.
+
+A file is read as chunks of records. Each chunk is validated on its own:
+names must be non-empty strings, statuses one of RELATIONSHIP_STATUSES and
+every edge a [u, v, status] triple; relationships are deduplicated within it
+regardless of direction. JSON Lines files of PARALLEL_FILE_SIZE and up are
+split by byte range across worker processes, which parse their share of the
+file as well as validating it. Other formats are parsed on one thread, so
+they are validated as they are read; sending their records to workers costs
+more than checking them.
+
+The chunks are then reconciled in file order. The first status given for a
+pair wins, and a later one that disagrees, such as the reversed copy older
+exports wrote for every relationship, is counted as a conflict. People only
+named by a relationship are added and counted as undeclared. Nothing touches
+the network until the whole file has been read, see
+RelationshipNetwork.import_file.
+"""
+import json
+import os
+from collections import deque
+
+from instrument import instruments
+from persistence import (BINARY_EXTENSION, RELATIONSHIP_STATUSES, SQLITE_EXTENSIONS, iter_json_records,
+                         load_binary_snapshot)
+
+IMPORT_CHUNK_SIZE = 50000  #Records validated together
+LINE_CHUNK_BYTES = 4 << 20  #Bytes of a JSON Lines file each worker task parses
+PARALLEL_FILE_SIZE = 16 << 20  #Smallest JSON Lines file validated across worker processes
+MAX_PROBLEMS = 20  #Invalid records kept as examples in the report
+
+
+class InvalidDataError(ValueError):
+    """A strict import found invalid records or conflicting relationships. Nothing was imported."""
+
+    def __init__(self, report):
+        examples = "".join(f"\n  {problem}" for problem in report.problems)
+        super().__init__(f"{report.invalid} invalid records and {report.conflicts} conflicting relationships "
+                         f"in {os.path.basename(report.path)}{examples}")
+        self.report = report
+
+
+class ImportReport:
+    """What reading a data file found, and what importing it changed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.people = 0  #Distinct people in the file
+        self.relationships = 0  #Distinct relationships in the file
+        self.duplicates = 0  #Relationships repeated with the same status, in either direction
+        self.conflicts = 0  #Relationships repeated with a different status, the first one was kept
+        self.invalid = 0  #Records skipped as malformed
+        self.undeclared = 0  #People only named by a relationship
+        self.problems = []  #Descriptions of the first MAX_PROBLEMS invalid records and conflicts
+        self.people_added = 0
+        self.relationships_added = 0
+        self.relationships_updated = 0  #Already in the network with another status, the file's was kept
+
+    def add_problems(self, problems):
+        self.problems.extend(problems[:MAX_PROBLEMS - len(self.problems)])
+
+    def __str__(self):
+        message = (f"Imported {self.people_added} new people and {self.relationships_added} new relationships, "
+                   f"updated {self.relationships_updated}.")
+        skipped = [f"{count} {what}" for count, what in ((self.duplicates, "duplicate"),
+                                                         (self.conflicts, "conflicting"),
+                                                         (self.invalid, "invalid"),
+                                                         (self.undeclared, "undeclared people added"))
+                   if count]
+        if skipped:
+            message += f" ({', '.join(skipped)})"
+        return message
+
+
+class ImportData:
+    """A data file read for import: distinct names, {(u, v): status} for each pair and the saved positions."""
+
+    def __init__(self, names, relationships, positions, report):
+        self.names = names
+        self.relationships = relationships
+        self.positions = positions
+        self.report = report
+
+
+def validate_chunk(nodes, edges):
+    """Returns (names, relationships, duplicates, conflicts, invalid, problems) for one chunk of records.
+
+    relationships maps each pair, lower name first, to the first status given
+    for it in the chunk.
+    """
+    names = []
+    relationships = {}
+    duplicates = conflicts = invalid = 0
+    problems = []
+
+    for node in nodes:
+        if isinstance(node, str) and node.strip():
+            names.append(node)
+        else:
+            invalid += 1
+            problems.append(f"Person {node!r}: names must be non-empty text")
+
+    for edge in edges:
+        problem = _edge_problem(edge)
+        if problem is not None:
+            invalid += 1
+            problems.append(f"Relationship {edge!r}: {problem}")
+            continue
+        u, v, status = edge
+        pair = (u, v) if u <= v else (v, u)
+        previous = relationships.get(pair)
+        if previous is None:
+            relationships[pair] = status
+        elif previous == status:
+            duplicates += 1
+        else:
+            conflicts += 1
+            problems.append(f"Relationship {u} - {v}: {status!r} conflicts with {previous!r}, kept {previous!r}")
+    return names, relationships, duplicates, conflicts, invalid, problems[:MAX_PROBLEMS]
+
+
+def _edge_problem(edge):
+    if not isinstance(edge, (list, tuple)) or len(edge) != 3:
+        return "expected [person, person, status]"
+    u, v, status = edge
+    if not all(isinstance(name, str) and name.strip() for name in (u, v)):
+        return "names must be non-empty text"
+    if status not in RELATIONSHIP_STATUSES:
+        return f"unknown status {status!r}"
+    return None
+
+
+def _positions_problem(name, position):
+    if not isinstance(name, str) or not isinstance(position, (list, tuple)) or len(position) != 2:
+        return "expected {name: [x, y]}"
+    if not all(isinstance(xy, (int, float)) and not isinstance(xy, bool) for xy in position):
+        return "coordinates must be numbers"
+    return None
+
+
+def validate_positions(positions):
+    """Returns ({name: (x, y)}, invalid, problems) for the saved map positions of a data file."""
+    if not isinstance(positions, dict):
+        return {}, 1, [f"Positions {positions!r}: expected {{name: [x, y]}}"]
+
+    valid = {}
+    invalid = 0
+    problems = []
+    for name, position in positions.items():
+        problem = _positions_problem(name, position)
+        if problem is None:
+            valid[name] = tuple(position)
+        else:
+            invalid += 1
+            problems.append(f"Position of {name!r} {position!r}: {problem}")
+    return valid, invalid, problems[:MAX_PROBLEMS]
+
+
+def _line_records(lines):
+    #Yields the records of iter_jsonl_records, or ("invalid", problem) for a row that is not one, instead of raising
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield "invalid", f"Line {line.strip()[:80]!r}: not valid JSON"
+            continue
+        if not isinstance(row, list) or not row or not isinstance(row[0], str):
+            yield "invalid", f"Row {row!r}: expected [kind, ...]"
+        elif row[0] == "edge":
+            yield "edges", row[1:]  #Checked with the other relationships
+        elif len(row) != 2:
+            yield "invalid", f"Row {row!r}: expected [{row[0]!r}, value]"
+        elif row[0] == "node":
+            yield "nodes", row[1]
+        else:
+            yield row[0], row[1]
+
+
+def _validate_task(task):
+    #Runs in a worker process for large files, so it only takes and returns picklable values
+    kind, *args = task
+    extra = {}
+    bad_rows = []
+    if kind == "lines":
+        path, start, end = args
+        with open(path, "rb") as f:
+            f.seek(start)
+            lines = f.read(end - start).decode("utf-8").splitlines()
+        nodes, edges = [], []
+        for key, value in _line_records(lines):
+            if key == "nodes":
+                nodes.append(value)
+            elif key == "edges":
+                edges.append(value)
+            elif key == "invalid":
+                bad_rows.append(value)
+            else:
+                extra[key] = value
+    else:
+        nodes, edges = args
+    names, relationships, duplicates, conflicts, invalid, problems = validate_chunk(nodes, edges)
+    return (names, relationships, duplicates, conflicts, invalid + len(bad_rows), (bad_rows + problems)[:MAX_PROBLEMS],
+            extra)
+
+
+class _ProgressFile:
+    """A text file that counts the characters read from it, for reporting progress through a parse."""
+
+    def __init__(self, f):
+        self.f = f
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.position += len(data)
+        return data
+
+
+def _record_tasks(records, size, position):
+    #Groups streamed (key, value) records into validation tasks, with the other top-level members last
+    nodes, edges, extra = [], [], {}
+    for key, value in records:
+        if key == "nodes":
+            nodes.append(value)
+        elif key == "edges":
+            edges.append(value)
+        else:
+            extra[key] = value
+        if len(nodes) + len(edges) >= IMPORT_CHUNK_SIZE:
+            yield ("records", nodes, edges), min(1.0, position() / size)
+            nodes, edges = [], []
+    yield ("records", nodes, edges), 1.0
+    if extra:
+        yield ("extra", extra), 1.0
+
+
+def _line_tasks(path, size):
+    #Splits a JSON Lines file into byte ranges that end on line boundaries
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + LINE_CHUNK_BYTES, size))
+            f.readline()
+            end = min(f.tell(), size)
+            yield ("lines", path, start, end), end / size
+            start = end
+
+
+def _binary_tasks(path):
+    names, statuses, src, dst, codes, extra = load_binary_snapshot(path)
+    total = len(names) + len(src)
+    for start in range(0, len(names), IMPORT_CHUNK_SIZE):
+        yield ("records", names[start:start + IMPORT_CHUNK_SIZE], []), (start + IMPORT_CHUNK_SIZE) / total
+    for start in range(0, len(src), IMPORT_CHUNK_SIZE):
+        stop = start + IMPORT_CHUNK_SIZE
+        rows = zip(src[start:stop].tolist(), dst[start:stop].tolist(), codes[start:stop].tolist())
+        edges = [[names[u], names[v], statuses[code]] for u, v, code in rows]
+        yield ("records", [], edges), min(1.0, (len(names) + stop) / total)
+    yield ("extra", extra), 1.0
+
+
+def _database_tasks(path):
+    from sqlstore import SqliteStore
+
+    source = SqliteStore(path, read_only=True)
+    try:
+        total = max(1, len(source) + source.relationship_count)
+        done = 0
+        for names in _chunks(iter(source), IMPORT_CHUNK_SIZE):
+            done += len(names)
+            yield ("records", names, []), done / total
+        for edges in _chunks(source.relationships(), IMPORT_CHUNK_SIZE):
+            done += len(edges)
+            yield ("records", [], edges), done / total
+        yield ("extra", {"positions": source.load_positions()}), 1.0
+    finally:
+        source.close()
+
+
+def _chunks(iterator, size):
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _tasks(path, size):
+    """Yields (task, fraction of the file read) for every chunk of the file at path."""
+    lowered = path.lower()
+    if lowered.endswith(SQLITE_EXTENSIONS):
+        yield from _database_tasks(path)
+    elif path.endswith(BINARY_EXTENSION):
+        yield from _binary_tasks(path)
+    elif path.endswith(".jsonl"):
+        yield from _line_tasks(path, size)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            counted = _ProgressFile(f)
+            records = iter_json_records(counted)
+            yield from _record_tasks(records, size, lambda: counted.position)
+
+
+def _validated(tasks, processes):
+    """Yields (result, fraction) for each task in order, validating ahead over a pool of processes if given."""
+    if not processes or processes < 2:
+        for task, fraction in tasks:
+            yield (task[1] if task[0] == "extra" else _validate_task(task)), fraction
+        return
+
+    import multiprocessing  #Deferred, small files never start a pool
+    from concurrent.futures import ProcessPoolExecutor
+
+    #Spawned rather than forked, the importing process may be running a GUI and a writer thread
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processes, mp_context=context) as pool:
+        pending = deque()
+        for task, fraction in tasks:
+            if task[0] == "extra":
+                pending.append((None, task[1], fraction))
+            else:
+                pending.append((pool.submit(_validate_task, task), None, fraction))
+            #Keeps a bounded number of chunks in flight, so memory does not grow with the file
+            while len(pending) > processes * 2:
+                future, extra, fraction = pending.popleft()
+                yield (extra if future is None else future.result()), fraction
+        while pending:
+            future, extra, fraction = pending.popleft()
+            yield (extra if future is None else future.result()), fraction
+
+
+def _add_positions(positions, extra, report):
+    if "positions" in extra:
+        valid, invalid, problems = validate_positions(extra["positions"])
+        positions.update(valid)
+        report.invalid += invalid
+        report.add_problems(problems)
+
+
+@instruments.timed("import.read")
+def read_import(path, strict=False, progress=None, processes=None):
+    """Reads, validates and reconciles a data file for import, returning ImportData.
+
+    With strict, any invalid record or conflicting relationship raises
+    InvalidDataError instead of being skipped. progress, if given, is called
+    with (fraction read, message) after every chunk. processes sets the
+    worker pool for a JSON Lines file, by default every core for files of
+    PARALLEL_FILE_SIZE and up and none for smaller ones; other formats are
+    always read without one.
+    """
+    size = max(1, os.path.getsize(path))
+    if not path.endswith(".jsonl"):
+        processes = 0
+    elif processes is None:
+        processes = (os.cpu_count() or 1) if size >= PARALLEL_FILE_SIZE else 0
+
+    report = ImportReport(path)
+    names = {}  #Insertion-ordered set
+    relationships = {}
+    positions = {}
+    for result, fraction in _validated(_tasks(path, size), processes):
+        if isinstance(result, dict):
+            _add_positions(positions, result, report)
+            continue
+
+        chunk_names, chunk_relationships, duplicates, conflicts, invalid, problems, extra = result
+        _add_positions(positions, extra, report)
+        report.duplicates += duplicates
+        report.conflicts += conflicts
+        report.invalid += invalid
+        report.add_problems(problems)
+        names.update(dict.fromkeys(chunk_names))
+        for pair, status in chunk_relationships.items():
+            previous = relationships.get(pair)
+            if previous is None:
+                relationships[pair] = status
+            elif previous == status:
+                report.duplicates += 1
+            else:
+                report.conflicts += 1
+                report.add_problems([f"Relationship {pair[0]} - {pair[1]}: {status!r} conflicts with "
+                                     f"{previous!r}, kept {previous!r}"])
+        if progress is not None:
+            progress(fraction, f"Validated {len(names)} people and {len(relationships)} relationships")
+
+    if strict and (report.invalid or report.conflicts):
+        raise InvalidDataError(report)
+
+    #People only named by a relationship are still added, as they always were
+    for pair in relationships:
+        for name in pair:
+            if name not in names:
+                names[name] = None
+                report.undeclared += 1
+    report.people = len(names)
+    report.relationships = len(relationships)
+    return ImportData(list(names), relationships, positions, report)
@@ -0,0 +1,189 @@
+"""Timers and counters around the hot paths, for seeing where the time goes when the app feels stuck.
+
+Nothing is recorded until instruments.enable() is called, from the stats
+panel or by setting CONNECTIVITY_INSTRUMENT=1 in the environment. Until then a
+timed function costs one flag check per call and a span a shared no-op
+context manager.
+
+    @instruments.timed("network.load")
+    def load(self): ...
+
+    with instruments.span("map.draw"):
+        ...
+    instruments.count("journal.entries", len(entries))
+
+The recorded spans export as Chrome trace JSON, for chrome://tracing or
+Perfetto, one track per thread. cProfile and tracemalloc captures are
+switched on separately, as they slow everything down while they run.
+"""
+import contextlib
+import functools
+import io
+import json
+import os
+import threading
+import time
+
+MAX_EVENTS = 100000  #Spans kept for the trace, the oldest are dropped first
+PROFILE_LINES = 25  #Functions listed by a cProfile report
+MEMORY_LINES = 15  #Source lines listed by a tracemalloc report
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("instruments", "name", "start")
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name, self.start, time.perf_counter_ns() - self.start)
+
+
+class Instruments:
+    """Named timers and counters, shared by every thread, with optional cProfile and tracemalloc captures."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timers = {}  #Name -> [calls, total ns, longest ns]
+        self.counters = {}  #Name -> total
+        self.events = []  #(name, start ns, duration ns, thread id) for the trace
+        self.thread_names = {}  #Thread id -> name, kept for threads that have finished by the export
+        self.origin = time.perf_counter_ns()  #Time zero of the trace
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.events.clear()
+            self.thread_names.clear()
+            self.origin = time.perf_counter_ns()
+
+    def span(self, name):
+        """Returns a context manager timing its block under name, or a shared no-op one while disabled."""
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def timed(self, name):
+        """Decorates a function to be timed under name whenever the instruments are enabled."""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, start, time.perf_counter_ns() - start)
+            return wrapper
+        return decorate
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name, start, duration):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, duration, duration]
+            else:
+                timer[0] += 1
+                timer[1] += duration
+                timer[2] = max(timer[2], duration)
+            if len(self.events) >= MAX_EVENTS:
+                del self.events[:MAX_EVENTS // 10]  #Drops in bulk, so a long session stays cheap
+            thread = threading.current_thread()
+            self.thread_names[thread.ident] = thread.name
+            self.events.append((name, start, duration, thread.ident))
+
+    def summary(self):
+        """Returns [(name, calls, total ms, mean ms, longest ms)], the most total time first."""
+        with self._lock:
+            rows = [(name, calls, total / 1e6, total / calls / 1e6, longest / 1e6)
+                    for name, (calls, total, longest) in self.timers.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def export_chrome_trace(self, path):
+        """Writes the recorded spans, and the counter totals, as a Chrome trace JSON file."""
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+            origin = self.origin
+            threads = dict(self.thread_names)
+        pid = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in threads.items()]
+        trace.extend({"name": name, "ph": "X", "ts": (start - origin) / 1000, "dur": duration / 1000,
+                      "pid": pid, "tid": tid} for name, start, duration, tid in events)
+        now = (time.perf_counter_ns() - origin) / 1000
+        trace.extend({"name": name, "ph": "C", "ts": now, "pid": pid, "args": {"total": total}}
+                     for name, total in counters.items())
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+    @property
+    def profiling(self):
+        return self.profiler is not None
+
+    def start_profile(self):
+        """Starts a cProfile capture of the calling thread."""
+        import cProfile
+
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self, path=None):
+        """Stops the cProfile capture, saving it to path if given, and returns the slowest functions as text."""
+        import pstats
+
+        profiler, self.profiler = self.profiler, None
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        return report.getvalue()
+
+    @property
+    def tracing_memory(self):
+        import tracemalloc
+
+        return tracemalloc.is_tracing()
+
+    def start_memory(self):
+        """Starts tracing allocations with tracemalloc."""
+        import tracemalloc
+
+        tracemalloc.start()
+
+    def stop_memory(self):
+        """Stops tracing allocations and returns the peak and the lines holding the most memory as text."""
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lines = [f"Traced memory: {current / 2 ** 20:.1f} MB now, {peak / 2 ** 20:.1f} MB peak"]
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:MEMORY_LINES])
+        return "\n".join(lines)
+
+
+#"0", "false", "no" and "off" leave it off, as an empty value does
+instruments = Instruments(enabled=os.environ.get("CONNECTIVITY_INSTRUMENT", "").strip().lower()
+                          not in ("", "0", "false", "no", "off"))
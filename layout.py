@@ -0,0 +1,91 @@
+import random
+
+LAYOUT_ENGINES = ("auto", "spring", "force")
+SPRING_LIMIT = 1000  #Largest network "auto" lays out with networkx's spring_layout
+INCREMENTAL_LIMIT = 0.1  #Largest share of changed people that only moves those people
+
+
+class LayoutCache:
+    """Map positions kept between maps, and saved with the data, so only changed people need laying out again."""
+
+    def __init__(self):
+        self.positions = {}  #Name -> (x, y)
+        self.changed = set()  #People added or whose relationships changed since the last layout
+
+    def load(self, positions, people):
+        self.positions = {name: tuple(xy) for name, xy in positions.items() if name in people}
+        self.changed.clear()
+
+    def place(self, positions, people):
+        """Adds saved positions for the people in people who do not have one yet."""
+        for name, xy in positions.items():
+            if name not in self.positions and name in people:
+                self.positions[name] = tuple(xy)
+
+    def clear(self):
+        self.positions.clear()
+        self.changed.clear()
+
+    def touch(self, *names):
+        self.changed.update(names)
+
+    def rename(self, old_name, new_name):
+        if old_name in self.positions:
+            self.positions[new_name] = self.positions.pop(old_name)
+        if old_name in self.changed:
+            self.changed.discard(old_name)
+            self.changed.add(new_name)
+
+    def remove(self, name):
+        self.positions.pop(name, None)
+        self.changed.discard(name)
+
+    def is_current(self, graph):
+        return not self.changed and len(self.positions) == len(graph)
+
+    def update(self, positions):
+        self.positions.update(positions)
+        self.changed.clear()
+
+    def compute(self, graph, engine="auto", seed=None):
+        """Returns {name: (x, y)} for every node, starting from the cached positions.
+
+        When only a few people changed, only they are moved and everyone else
+        stays put; otherwise the whole network is relaid out, warm-started
+        from where everyone was last time.
+        """
+        nodes = list(graph)
+        if not nodes:
+            return {}
+
+        stale = {name for name in nodes if name not in self.positions or name in self.changed}
+        incremental = len(stale) <= INCREMENTAL_LIMIT * len(nodes)
+        start = self._seed_positions(graph, stale, random.Random(seed))
+        moving = stale if incremental else None
+        iterations = 30 if incremental else 50
+
+        if engine == "auto":
+            engine = "spring" if len(nodes) <= SPRING_LIMIT else "force"
+        #The engines are imported on first use, keeping networkx and numpy out of a plain import
+        if engine == "spring":
+            import networkx as nx
+            fixed = [name for name in nodes if name not in stale] if incremental else None
+            positions = nx.spring_layout(graph, pos=start, fixed=fixed or None, iterations=iterations, seed=seed)
+            return {name: (float(x), float(y)) for name, (x, y) in positions.items()}
+        if engine == "force":
+            from geometry import force_directed_layout
+            return force_directed_layout(nodes, graph.edges(), start, moving, iterations)
+        raise ValueError(f"Unknown layout engine {engine!r}")
+
+    def _seed_positions(self, graph, stale, rng):
+        #New or changed people start next to the neighbours that already have a place
+        start = {name: xy for name, xy in self.positions.items() if name in graph}
+        for name in stale:
+            placed = [start[other] for other in graph[name] if other in start and other != name]
+            if placed:
+                x = sum(xy[0] for xy in placed) / len(placed)
+                y = sum(xy[1] for xy in placed) / len(placed)
+                start[name] = (x + rng.uniform(-0.05, 0.05), y + rng.uniform(-0.05, 0.05))
+            elif name not in start:
+                start[name] = (rng.uniform(-1, 1), rng.uniform(-1, 1))
+        return start
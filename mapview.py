@@ -0,0 +1,245 @@
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba, to_rgba_array
+from matplotlib.patches import Rectangle
+
+from geometry import SpatialIndex
+from instrument import instruments
+
+STATUS_COLORS = {
+    "Friend": "green",
+    "Dislike": "red",
+    "Together": "pink",
+    "Exes": "black",
+    "Best Friends": "blue",
+    "Complicated": "orange",
+    "Situationship": "yellow",
+    "Acquaintances": "lightblue",
+    "Likes": "purple",
+    "Distant": "gray"
+}
+NODE_SIZE = 500
+SELECTED_NODE_SIZE = 1000
+NODE_COLOR = "lightgray"
+SELECTED_NODE_COLOR = "yellow"
+FADED_EDGE_COLOR = "lightgray"
+SELECTED_EDGE_WIDTH = 3
+NODE_DETAIL_LIMIT = 5000  #Most people in view drawn one by one, beyond that they are drawn as clusters
+EDGE_DETAIL_LIMIT = 10000  #Most relationships drawn one by one, beyond that only those of people in view are
+LABEL_LIMIT = 50  #Most names shown at once, the best connected people in view first
+CLUSTER_GRID_SIZE = 48  #Cells per side of the view when people are drawn as clusters
+CLUSTER_EDGE_LIMIT = 5000  #Most lines between clusters, the pairs with the most relationships first
+
+
+class MapView:
+    """The artists of a relationship map, kept between redraws and updated in place.
+
+    People are one PathCollection and relationships one LineCollection, with
+    the selected person's relationships drawn again on top in a second, small
+    LineCollection. Selecting someone only rewrites their own row of the node
+    arrays and the segments of their own relationships, found through an
+    index of each person's edges, so it costs O(degree) instead of redrawing
+    the whole network.
+
+    Only what is in view is drawn. update_view culls people through a spatial
+    index and relationships by their bounding boxes, labels only the best
+    connected people in view, and once too many people are in view draws
+    them as clusters on a grid, with one line per pair of related clusters.
+    """
+
+    @instruments.timed("map.draw")
+    def __init__(self, ax, positions, edge_table, statuses=None):
+        self.ax = ax
+        self.names = edge_table.names
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.xy = np.array([positions[name] for name in self.names], dtype=float).reshape(-1, 2)
+        self.spatial_index = SpatialIndex(self.names, self.xy)
+        n = len(self.names)
+
+        #Only the relationships with the given statuses are drawn, picked out of the table's status partitions
+        edge_ids = slice(None) if statuses is None else edge_table.with_status(*statuses)
+        self.src = edge_table.src[edge_ids].astype(np.intp)
+        self.dst = edge_table.dst[edge_ids].astype(np.intp)
+        palette = to_rgba_array([STATUS_COLORS.get(status, "black") for status in edge_table.statuses]).reshape(-1, 4)
+        self.edge_colors = palette[edge_table.codes[edge_ids]]
+        edge_count = len(self.src)
+
+        #Each person's edges, CSR style: edge ids sorted by endpoint plus where each person's run starts
+        ends = np.concatenate((self.src, self.dst))
+        order = np.argsort(ends, kind="stable")
+        self.incident_edges = np.concatenate((np.arange(edge_count), np.arange(edge_count)))[order]
+        self.incident_starts = np.searchsorted(ends[order], np.arange(n + 1))
+        self.degrees = np.diff(self.incident_starts)
+
+        self.node_sizes = np.full(n, NODE_SIZE, dtype=float)
+        self.node_colors = np.tile(to_rgba(NODE_COLOR), (n, 1))
+        self.segments = np.stack((self.xy[self.src], self.xy[self.dst]), axis=1).reshape(-1, 2, 2)
+        self.segment_low = self.segments.min(axis=1)
+        self.segment_high = self.segments.max(axis=1)
+        self.selected = None
+        self.detailed = True
+        self.visible = np.empty(0, dtype=np.intp)  #People drawn one by one
+        self.shown_edge_colors = np.empty((0, 4))
+        self.labels = {}  #Person index -> Text
+
+        self.edge_artist = LineCollection([], linewidths=1, zorder=1)
+        self.highlight_artist = LineCollection([], linewidths=SELECTED_EDGE_WIDTH, zorder=1)
+        ax.add_collection(self.edge_artist)
+        ax.add_collection(self.highlight_artist)
+        self.cluster_artist = ax.scatter([], [], c=NODE_COLOR, zorder=2)
+        self.node_artist = ax.scatter([], [], zorder=2)
+
+        if n:
+            low, high = self.xy.min(axis=0), self.xy.max(axis=0)
+            margin = np.maximum(high - low, 0.2) * 0.05
+            ax.set_xlim(low[0] - margin[0], high[0] + margin[0])
+            ax.set_ylim(low[1] - margin[1], high[1] + margin[1])
+        self.update_view()
+
+    def incident(self, name):
+        """Returns the ids of name's edges."""
+        i = self.index[name]
+        return self.incident_edges[self.incident_starts[i]:self.incident_starts[i + 1]]
+
+    @instruments.timed("map.select")
+    def select(self, name):
+        """Highlights name and their relationships, fading the rest. None clears the selection."""
+        if self.selected is not None:
+            i = self.index[self.selected]
+            self.node_sizes[i] = NODE_SIZE
+            self.node_colors[i] = to_rgba(NODE_COLOR)
+        self.selected = name
+
+        if name is None:
+            self.highlight_artist.set_segments([])
+        else:
+            i = self.index[name]
+            self.node_sizes[i] = SELECTED_NODE_SIZE
+            self.node_colors[i] = to_rgba(SELECTED_NODE_COLOR)
+            edge_ids = self.incident(name)
+            self.highlight_artist.set_segments(self.segments[edge_ids])
+            self.highlight_artist.set_color(self.edge_colors[edge_ids])
+
+        self._show_nodes()
+        self._show_edge_colors()
+        self._show_labels()
+
+    @instruments.timed("map.update_view")
+    def update_view(self):
+        """Redraws what is inside the current axis limits, to be called whenever they change."""
+        (x0, x1), (y0, y1) = self.ax.get_xlim(), self.ax.get_ylim()
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        in_view = self.spatial_index.within(x0, x1, y0, y1)
+        edge_ids = np.flatnonzero((self.segment_high[:, 0] >= x0) & (self.segment_low[:, 0] <= x1)
+                                  & (self.segment_high[:, 1] >= y0) & (self.segment_low[:, 1] <= y1))
+        detailed_edges = edge_ids
+        if len(in_view) <= NODE_DETAIL_LIMIT < len(edge_ids):
+            #Leaves out relationships only passing through the view
+            shown = np.zeros(len(self.names), dtype=bool)
+            shown[in_view] = True
+            detailed_edges = edge_ids[shown[self.src[edge_ids]] | shown[self.dst[edge_ids]]]
+        self.detailed = len(in_view) <= NODE_DETAIL_LIMIT and len(detailed_edges) <= EDGE_DETAIL_LIMIT
+
+        if self.detailed:
+            self.visible = np.sort(in_view)
+            self.edge_artist.set_segments(self.segments[detailed_edges])
+            self.edge_artist.set_linewidths(1)
+            self.shown_edge_colors = self.edge_colors[detailed_edges]
+            self.cluster_artist.set_offsets(np.empty((0, 2)))
+        else:
+            self.visible = np.empty(0, dtype=np.intp)
+            self._show_clusters(in_view, edge_ids, (x0, y0), (x1 - x0, y1 - y0))
+
+        self._top_people = self._most_connected(in_view)
+        self._show_nodes()
+        self._show_edge_colors()
+        self._show_labels()
+
+    def _show_clusters(self, in_view, edge_ids, low, span):
+        #People off screen but related to someone in view are clustered too, so lines end where they should
+        members = np.unique(np.concatenate((in_view, self.src[edge_ids], self.dst[edge_ids])))
+        grid = CLUSTER_GRID_SIZE
+        cells = np.clip(np.floor((self.xy[members] - low) / np.maximum(span, 1e-9) * grid), -grid, 2 * grid - 1)
+        cell_keys = (cells[:, 0].astype(np.int64) + grid) * 3 * grid + (cells[:, 1].astype(np.int64) + grid)
+        keys, member_clusters, counts = np.unique(cell_keys, return_inverse=True, return_counts=True)
+        centres = np.column_stack([np.bincount(member_clusters, weights=self.xy[members, axis], minlength=len(keys))
+                                   for axis in (0, 1)]) / counts[:, None]
+        #Only the clusters in view get a marker, the cells off screen only anchor lines
+        on_screen = np.unique(member_clusters[np.searchsorted(members, in_view)])
+        self.cluster_artist.set_offsets(centres[on_screen].reshape(-1, 2))
+        self.cluster_artist.set_sizes(np.clip(20 * np.sqrt(counts[on_screen]), 20, 2000))
+
+        #One line per pair of related clusters, as thick as their number of relationships and the average of their colours
+        cluster_of = np.empty(len(self.names), dtype=np.int64)
+        cluster_of[members] = member_clusters
+        a, b = cluster_of[self.src[edge_ids]], cluster_of[self.dst[edge_ids]]
+        between = a != b
+        a, b, edge_ids = a[between], b[between], edge_ids[between]
+        pairs, pair_ids, pair_counts = np.unique(np.minimum(a, b) * len(keys) + np.maximum(a, b),
+                                                 return_inverse=True, return_counts=True)
+        if len(pairs) > CLUSTER_EDGE_LIMIT:
+            strongest = np.sort(np.argpartition(-pair_counts, CLUSTER_EDGE_LIMIT)[:CLUSTER_EDGE_LIMIT])
+            kept = np.full(len(pairs), -1, dtype=np.intp)
+            kept[strongest] = np.arange(len(strongest))
+            pair_ids = kept[pair_ids]
+            keep = pair_ids >= 0
+            pairs, pair_counts = pairs[strongest], pair_counts[strongest]
+            pair_ids, edge_ids = pair_ids[keep], edge_ids[keep]
+        self.edge_artist.set_segments(np.stack((centres[pairs // len(keys)], centres[pairs % len(keys)]), axis=1))
+        self.edge_artist.set_linewidths(0.5 + np.log1p(pair_counts))
+        self.shown_edge_colors = np.column_stack([
+            np.bincount(pair_ids, weights=self.edge_colors[edge_ids, channel], minlength=len(pairs))
+            for channel in range(4)]) / np.maximum(pair_counts, 1)[:, None]
+
+    def _most_connected(self, in_view):
+        if len(in_view) <= LABEL_LIMIT:
+            return in_view
+        return in_view[np.argpartition(-self.degrees[in_view], LABEL_LIMIT)[:LABEL_LIMIT]]
+
+    def _show_nodes(self):
+        shown = self.visible
+        if not self.detailed and self.selected is not None:
+            shown = np.array([self.index[self.selected]])
+        self.node_artist.set_offsets(self.xy[shown].reshape(-1, 2))
+        self.node_artist.set_sizes(self.node_sizes[shown])
+        self.node_artist.set_facecolor(self.node_colors[shown])
+
+    def _show_edge_colors(self):
+        #A single colour for every faded edge, so nothing per edge is rebuilt while someone is selected
+        self.edge_artist.set_color(FADED_EDGE_COLOR if self.selected is not None else self.shown_edge_colors)
+
+    def _show_labels(self):
+        wanted = set(self._top_people.tolist())
+        if self.selected is not None:
+            wanted.add(self.index[self.selected])
+        for i in self.labels.keys() - wanted:
+            self.labels.pop(i).remove()
+        for i in wanted - self.labels.keys():
+            x, y = self.xy[i]
+            self.labels[i] = self.ax.text(x, y, self.names[i], fontsize=12, ha="center", va="center",
+                                          zorder=3, clip_on=True)
+
+
+def draw_legend(fig):
+    """Adds the status colours as a legend to the right of the map."""
+    legend_ax = fig.add_axes([0.85, 0.1, 0.12, 0.8])  #Positions the legend to the right of the graph
+
+    #Adds a semi-transparent legend with colored boxes
+    box_size = 0.02  #Size of the color boxes
+    spacing = 0.04  #Vertical spacing between legend entries
+    legend_x = 0.5  #X-coordinate of the boxes within the legend axis
+    legend_y = 1  #Starting Y-coordinate at the top
+
+    #Turns off the axis of the legend (no ticks or grid)
+    legend_ax.axis('off')
+
+    #Adds colored boxes and their labels in the legend
+    for i, (label, color) in enumerate(STATUS_COLORS.items()):
+        #Adds a colored rectangle (legend box)
+        legend_ax.add_patch(Rectangle((legend_x - box_size / 2, legend_y - i * spacing),
+                                      box_size, box_size, color=color))
+
+        #Adds the label next to the color box
+        legend_ax.text(legend_x + box_size / 2 + 0.01, legend_y - i * spacing, label, fontsize=10, va='center')
+    return legend_ax
@@ -0,0 +1,555 @@
+import csv
+import json
+import mmap
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+from array import array
+
+from instrument import instruments
+
+RELATIONSHIP_STATUSES = ("Friend", "Dislike", "Together", "Exes", "Best Friends",
+                         "Complicated", "Situationship", "Acquaintances", "Likes", "Distant")
+
+CHUNK_SIZE = 1 << 20  #Characters read from a data file at a time
+BATCH_SIZE = 10000  #Nodes or edges encoded or added to the network at a time
+STREAMED_KEYS = ("nodes", "edges")
+WRITER_CLOSE_TIMEOUT = 60  #Seconds closing waits for the writer's final snapshot before giving up on it
+BARRIER = "barrier"  #Journaled for a change too large to journal, such as an import, see ChangeJournal.replay
+
+BINARY_EXTENSION = ".rmap"
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+_BINARY_MAGIC = b"RMAP"
+_BINARY_VERSION = 1
+#Magic, version, reserved, node count, edge count, name table size, metadata size
+_BINARY_HEADER = struct.Struct("<4sHHIIQQ")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class ChangeJournal:
+    """Append-only log of network changes, replayed on top of the last snapshot."""
+
+    def __init__(self, path, compact_every=1000):
+        self.path = path
+        self.compact_every = compact_every  #Number of entries before a snapshot is due
+        self.seq = 0  #Sequence number of the newest entry
+        self.pending = 0  #Entries written since the last compaction
+        self._file = None
+
+    def next_seq(self):
+        """Reserves the sequence number for a change that will be written later."""
+        self.seq += 1
+        return self.seq
+
+    @instruments.timed("journal.write")
+    def write(self, entries):
+        """Appends (seq, op, args) entries with a single fsync."""
+        instruments.count("journal.entries", len(entries))
+        lines = "".join(json.dumps([seq, op, *args]) + "\n" for seq, op, args in entries)
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(lines)
+        self._file.flush()
+        os.fsync(self._file.fileno())  #The entries are durable once write returns
+        self.pending += len(entries)
+
+    def needs_compaction(self):
+        return self.pending >= self.compact_every
+
+    def replay(self, after_seq=0, truncate=True):
+        """Returns the (op, args) entries newer than after_seq, dropping a torn tail left by a crash.
+
+        A BARRIER newer than after_seq means the snapshot meant to follow it was
+        never written, so the changes after it were made on top of a network
+        neither the snapshot nor the journal holds. Replay stops there and the
+        barrier and everything after it are dropped like a torn tail. Without
+        truncate the file is left as it is, for reading the journal of a
+        network another process has open.
+        """
+        entries = []
+        self.seq = max(self.seq, after_seq)
+        if not os.path.exists(self.path):
+            return entries
+
+        good_offset = 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    seq, op, *args = json.loads(raw)
+                except ValueError:
+                    break
+                if op == BARRIER and seq > after_seq:
+                    break
+                good_offset += len(raw)
+                self.seq = max(self.seq, seq)
+                if seq > after_seq:
+                    entries.append((op, args))
+
+        #Cuts off a partially written entry, or a barrier and what follows it, so new appends start on a clean line
+        if truncate and good_offset < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+
+        self.pending = len(entries)
+        return entries
+
+    def compact(self, upto_seq):
+        """Drops entries already covered by a snapshot taken at upto_seq."""
+        self.close()
+        if not os.path.exists(self.path):
+            self.pending = 0
+            return
+
+        if upto_seq >= self.seq:
+            open(self.path, "w").close()
+            self.pending = 0
+            return
+
+        #Entries appended after the snapshot was taken are kept
+        kept = []
+        with open(self.path, "rb") as f:
+            for raw in f:
+                try:
+                    seq = json.loads(raw)[0]
+                except ValueError:
+                    break
+                if seq > upto_seq:
+                    kept.append(raw)
+        with open(self.path, "wb") as f:
+            f.writelines(kept)
+        self.pending = len(kept)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _JsonChunkReader:
+    """Decodes JSON values one at a time from a file read in fixed-size chunks."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, grow=False):
+        #Growing by the buffered length keeps decoding one large value linear rather than quadratic
+        size = max(self.chunk_size, len(self.buf) - self.pos) if grow else self.chunk_size
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it, or "" at the end of the file."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found or 'end of file'!r}")
+        self.pos += 1
+
+    def skip(self, char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill(grow=True):
+                    raise
+                continue
+            #A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_records(f, chunk_size=CHUNK_SIZE):
+    """Yields (key, value) for each top-level member of a {"nodes", "edges"} document.
+
+    The nodes and edges arrays are yielded one element at a time so the whole
+    document never has to be held in memory.
+    """
+    reader = _JsonChunkReader(f, chunk_size)
+    reader.expect("{")
+    if reader.skip("}"):
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key in STREAMED_KEYS and reader.skip("["):
+            if not reader.skip("]"):
+                while True:
+                    yield key, reader.value()
+                    if not reader.skip(","):
+                        reader.expect("]")
+                        break
+        else:
+            yield key, reader.value()
+
+        if not reader.skip(","):
+            reader.expect("}")
+            return
+
+
+def iter_jsonl_records(f):
+    """Yields the same records as iter_json_records from a JSON Lines file of ["node", ...] and ["edge", ...] rows."""
+    for line in f:
+        if not line.strip():
+            continue
+        kind, *values = json.loads(line)
+        if kind == "node":
+            yield "nodes", values[0]
+        elif kind == "edge":
+            yield "edges", values
+        else:
+            yield kind, values[0]
+
+
+def read_records(path):
+    """Streams (key, value) records from a .json or .jsonl data file."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            yield from iter_jsonl_records(f)
+        else:
+            yield from iter_json_records(f)
+
+
+def read_changes(path):
+    """Yields (op, *args) changes from a CSV file with one change per row, such as set_relationship,Alice,Bob,Friend."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                yield (row[0].strip(), *row[1:])
+
+
+def _write_items(f, items):
+    #Encodes whole batches at once, which is much faster than json.dump's item-by-item encoder
+    first = True
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= BATCH_SIZE:
+            f.write(("" if first else ", ") + json.dumps(batch)[1:-1])
+            first = False
+            batch.clear()
+    if batch:
+        f.write(("" if first else ", ") + json.dumps(batch)[1:-1])
+
+
+def write_records(f, nodes, edges, extra=None):
+    """Writes nodes, edges and any extra members as a {"nodes", "edges"} document, one batch at a time."""
+    f.write('{"nodes": [')
+    _write_items(f, nodes)
+    f.write('], "edges": [')
+    _write_items(f, edges)
+    f.write("]")
+    for key, value in (extra or {}).items():
+        f.write(f", {json.dumps(key)}: {json.dumps(value)}")
+    f.write("}")
+
+
+def write_jsonl_records(f, nodes, edges, extra=None):
+    """Writes ["node", name] and ["edge", u, v, status] rows, then a [key, value] row for each extra member."""
+    for node in nodes:
+        f.write(json.dumps(["node", node]) + "\n")
+    for u, v, status in edges:
+        f.write(json.dumps(["edge", u, v, status]) + "\n")
+    for key, value in (extra or {}).items():
+        f.write(json.dumps([key, value]) + "\n")
+
+
+def write_binary_records(f, nodes, edges, extra=None):
+    """Writes a binary snapshot: metadata, an interned name table, then packed edge arrays.
+
+    Edges are stored as little-endian int32 indexes into the name table plus
+    one status code byte each, so they can be memory-mapped back without parsing.
+    """
+    names = list(nodes)
+    index = {name: i for i, name in enumerate(names)}
+    statuses = list(RELATIONSHIP_STATUSES)
+    codes_by_status = {status: i for i, status in enumerate(statuses)}
+
+    src = array("i")
+    dst = array("i")
+    codes = array("B")
+    for u, v, status in edges:
+        code = codes_by_status.get(status)
+        if code is None:
+            code = codes_by_status[status] = len(statuses)
+            statuses.append(status)
+        src.append(index[u])
+        dst.append(index[v])
+        codes.append(code)
+    if sys.byteorder == "big":
+        src.byteswap()
+        dst.byteswap()
+
+    name_table = "\0".join(names).encode("utf-8")
+    if names and name_table.count(b"\0") != len(names) - 1:
+        raise ValueError("Names containing NUL characters cannot be stored in a binary snapshot")
+    meta = json.dumps({"statuses": statuses, **(extra or {})}).encode("utf-8")
+
+    f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, _BINARY_VERSION, 0, len(names), len(src), len(name_table), len(meta)))
+    f.write(meta)
+    f.write(name_table)
+    f.write(b"\0" * (-(_BINARY_HEADER.size + len(meta) + len(name_table)) % 4))  #Aligns the int32 arrays
+    f.write(src.tobytes())
+    f.write(dst.tobytes())
+    f.write(codes.tobytes())
+
+
+def load_binary_snapshot(path):
+    """Memory-maps a binary snapshot.
+
+    Returns (names, statuses, src, dst, codes, extra) where src, dst and codes
+    are zero-copy NumPy views of the mapped file.
+    """
+    import numpy as np  #Only binary snapshots need NumPy
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, _, node_count, edge_count, names_size, meta_size = _BINARY_HEADER.unpack_from(mm, 0)
+    if magic != _BINARY_MAGIC or version != _BINARY_VERSION:
+        raise ValueError(f"{path} is not a version {_BINARY_VERSION} relationship snapshot")
+
+    offset = _BINARY_HEADER.size
+    extra = json.loads(mm[offset:offset + meta_size])
+    offset += meta_size
+    names = mm[offset:offset + names_size].decode("utf-8").split("\0") if node_count else []
+    offset += names_size
+    offset += -offset % 4
+
+    src = np.frombuffer(mm, dtype="<i4", count=edge_count, offset=offset)
+    offset += 4 * edge_count
+    dst = np.frombuffer(mm, dtype="<i4", count=edge_count, offset=offset)
+    offset += 4 * edge_count
+    codes = np.frombuffer(mm, dtype=np.uint8, count=edge_count, offset=offset)
+
+    statuses = extra.pop("statuses")
+    return names, statuses, src, dst, codes, extra
+
+
+def export_records(path, nodes, edges):
+    """Writes nodes and edges to path, as JSON Lines for .jsonl, a binary snapshot for .rmap and a database for .db."""
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        from sqlstore import write_database  #Deferred, only databases need sqlite3
+
+        write_database(path, nodes, edges)
+        return
+
+    if path.endswith(BINARY_EXTENSION):
+        with open(path, "wb") as f:
+            write_binary_records(f, nodes, edges)
+        return
+
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            write_jsonl_records(f, nodes, edges)
+        else:
+            write_records(f, nodes, edges)
+
+
+def add_records(store, records):
+    """Adds streamed node and edge records to a RelationshipStore in batches and returns any other top-level members."""
+    extra = {}
+    nodes = []
+    edges = []
+    for key, value in records:
+        if key == "nodes":
+            nodes.append(value)
+            if len(nodes) >= BATCH_SIZE:
+                store.add_people(nodes)
+                nodes.clear()
+        elif key == "edges":
+            edges.append(value)
+            if len(edges) >= BATCH_SIZE:
+                store.add_relationships(edges)
+                edges.clear()
+        else:
+            extra[key] = value
+
+    store.add_people(nodes)
+    store.add_relationships(edges)
+    return extra
+
+
+@instruments.timed("file.load")
+def load_file(store, path):
+    """Adds the contents of a .json, .jsonl, .rmap or .db data file and returns its other top-level members."""
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        from sqlstore import read_database
+
+        return read_database(store, path)
+
+    if not path.endswith(BINARY_EXTENSION):
+        return add_records(store, read_records(path))
+
+    names, statuses, src, dst, codes, extra = load_binary_snapshot(path)
+    store.add_people(names)
+    for start in range(0, len(src), BATCH_SIZE):
+        stop = start + BATCH_SIZE
+        rows = zip(src[start:stop].tolist(), dst[start:stop].tolist(), codes[start:stop].tolist())
+        store.add_relationships((names[u], names[v], statuses[code]) for u, v, code in rows)
+    return extra
+
+
+@instruments.timed("snapshot.write")
+def write_snapshot(path, data):
+    """Writes a snapshot in the format of path's extension to a temporary file, fsyncs it and renames it over path."""
+    tmp_path = path + ".tmp"
+    extra = {key: value for key, value in data.items() if key not in STREAMED_KEYS}
+    binary = path.endswith(BINARY_EXTENSION)
+    try:
+        with open(tmp_path, "wb" if binary else "w", encoding=None if binary else "utf-8") as f:
+            if binary:
+                write_binary_records(f, data["nodes"], data["edges"], extra)
+            elif path.endswith(".jsonl"):
+                write_jsonl_records(f, data["nodes"], data["edges"], extra)
+            else:
+                write_records(f, data["nodes"], data["edges"], extra)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    #Makes the rename itself durable
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class SaveCoordinator:
+    """Serializes snapshot writes and skips them when nothing changed since the last one."""
+
+    def __init__(self, path, lock):
+        self.path = path
+        self.lock = lock  #Held by everything that mutates the network
+        self.version = 0  #Bumped on every change
+        self.saved_version = 0  #Version captured by the last completed write
+        self._write_lock = threading.Lock()
+
+    def mark_dirty(self):
+        self.version += 1
+
+    def is_dirty(self):
+        return self.version != self.saved_version
+
+    def save(self, take_snapshot, force=False):
+        """Writes the snapshot returned by take_snapshot, or returns None if there was nothing to save or it returned None."""
+        with self._write_lock:
+            #Only copying the data happens under the lock, serializing it does not
+            with self.lock:
+                if not force and not self.is_dirty():
+                    return None
+                version = self.version
+                data = take_snapshot()
+            if data is None:
+                return None  #Not ready to be saved, the version stays dirty
+
+            write_snapshot(self.path, data)
+            self.saved_version = version
+            return data
+
+
+class BackgroundWriter:
+    """Writes journal entries and snapshots on a dedicated thread, collapsing bursts into one write."""
+
+    def __init__(self, journal, save, on_saved=None, on_error=None, interval=300, max_pending=10000):
+        self.journal = journal
+        self.save = save  #Writes a snapshot, returns None when there was nothing to save
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.interval = interval  #Seconds of idleness before an auto-save
+        self.queue = queue.Queue(maxsize=max_pending)  #Blocks producers if the disk falls behind
+        self.thread = threading.Thread(target=self._run, name="BackgroundWriter", daemon=True)
+        self.thread.start()
+
+    def append(self, seq, op, *args):
+        self.queue.put(("entry", (seq, op, args)))
+
+    def request_save(self):
+        self.queue.put(("save", None))
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been written."""
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self, timeout=WRITER_CLOSE_TIMEOUT):
+        """Writes what is queued and a final snapshot, then stops. Returns False if that took longer than timeout."""
+        self.request_save()
+        self.queue.put(("stop", None))
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.interval)]
+            except queue.Empty:
+                batch = [("save", None)]  #Periodic auto-save, skipped if nothing changed
+
+            #Drains whatever else is already waiting so a burst becomes one write
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            entries = [payload for kind, payload in batch if kind == "entry"]
+            wants_save = any(kind in ("save", "stop") for kind, _ in batch)
+            waiters = [payload for kind, payload in batch if kind == "flush"]
+            stopping = any(kind == "stop" for kind, _ in batch)
+
+            try:
+                if entries:
+                    self.journal.write(entries)
+                if wants_save or self.journal.needs_compaction():
+                    snapshot = self.save()
+                    if snapshot is not None and self.on_saved is not None:
+                        self.on_saved(snapshot)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+
+            for done in waiters:
+                done.set()
+            if stopping:
+                self.journal.close()
+                return
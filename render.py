@@ -0,0 +1,138 @@
+"""Headless rendering of relationship maps, for batch jobs without a display.
+
+Nothing here imports tkinter or pyplot. Figures are drawn straight onto the
+Agg canvas, and the output format comes from the file extension (.png, .svg
+or .pdf).
+
+Render the whole network, reusing the layout saved in the data file:
+
+    python render.py relationships.json map.png
+
+Render an ego map of each person and their relationships into a directory,
+spread over every core:
+
+    python render.py relationships.json maps/ --ego Alice --ego Bob
+    python render.py relationships.json maps/ --all-egos --format svg
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from core import RelationshipNetwork
+from layout import LAYOUT_ENGINES, LayoutCache
+from mapview import MapView, draw_legend
+
+_worker_store = None  #The network each pool process loads once and renders all its ego maps from
+
+
+def load_network(path):
+    """Returns (store, layout) for a data file, with the layout holding the positions saved in it.
+
+    A data file is loaded with the changes journaled since its snapshot, as
+    the app would open it. A database is opened read-only and queried in
+    place rather than loaded, so ego maps of a network larger than memory
+    only read the people they show.
+    """
+    network = RelationshipNetwork(path, read_only=True)
+    network.load()
+    return network.store, network.layout
+
+
+def render_map(path, store, positions, title="Relationship Map", selected=None, figsize=(12, 8), dpi=100):
+    """Draws store at positions and saves it to path."""
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0.02, 0.02, 0.8, 0.9])
+    view = MapView(ax, positions, store.edge_table())
+    if selected is not None:
+        view.select(selected)
+    draw_legend(fig)
+    ax.set_title(title)
+    ax.axis("off")
+    fig.savefig(path)
+    return path
+
+
+def render_network(data_file, path, engine="auto"):
+    store, layout = load_network(data_file)
+    network = store.to_networkx()
+    if not layout.is_current(network):
+        layout.update(layout.compute(network, engine, seed=0))
+    return render_map(path, store, layout.positions)
+
+
+def render_ego_map(store, name, path, engine="auto"):
+    """Draws name, everyone related to them and the relationships between those people, laid out on their own."""
+    ego = store.subgraph([name, *store.relations(name)])
+    positions = LayoutCache().compute(ego.to_networkx(), engine, seed=0)
+    return render_map(path, ego, positions, title=name, selected=name)
+
+
+def ego_map_paths(directory, names, extension):
+    """Returns the path of each name's ego map, numbering the names that would otherwise share a file.
+
+    Names differing only in characters a file name cannot hold, or only in
+    case on a case-insensitive file system, would overwrite each other.
+    """
+    paths = []
+    used = set()
+    for name in names:
+        stem = file_name = re.sub(r"[^\w\- .]", "_", name)
+        number = 1
+        while file_name.lower() in used:
+            number += 1
+            file_name = f"{stem} ({number})"
+        used.add(file_name.lower())
+        paths.append(os.path.join(directory, file_name + extension))
+    return paths
+
+
+def _load_worker(data_file):
+    global _worker_store
+    _worker_store = load_network(data_file)[0]
+
+
+def _render_worker_ego_map(task):
+    name, path, engine = task
+    return render_ego_map(_worker_store, name, path, engine)
+
+
+def render_ego_maps(data_file, names, directory, extension=".png", engine="auto", processes=None):
+    """Renders the ego map of every name into directory over a pool of processes, returning the paths written.
+
+    Each process loads the data file once, then renders the maps it is handed
+    in chunks, so the network is never sent between processes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(name, path, engine) for name, path in zip(names, ego_map_paths(directory, names, extension))]
+    processes = processes or os.cpu_count() or 1
+    chunk_size = max(1, len(tasks) // (processes * 4))
+    with ProcessPoolExecutor(processes, initializer=_load_worker, initargs=(data_file,)) as pool:
+        return list(pool.map(_render_worker_ego_map, tasks, chunksize=chunk_size))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_file", help="a .json, .jsonl, .rmap or .db data file")
+    parser.add_argument("output", help="the image to write, or the directory for ego maps")
+    parser.add_argument("--ego", action="append", default=[], metavar="NAME", help="render NAME's ego map")
+    parser.add_argument("--all-egos", action="store_true", help="render an ego map for everyone")
+    parser.add_argument("--format", default="png", choices=("png", "svg", "pdf"), help="ego map format")
+    parser.add_argument("--layout", default="auto", choices=LAYOUT_ENGINES)
+    parser.add_argument("--processes", type=int, help="processes rendering ego maps, every core by default")
+    args = parser.parse_args()
+
+    if args.ego or args.all_egos:
+        people = load_network(args.data_file)[0]
+        names = list(people) if args.all_egos else args.ego
+        unknown = [name for name in names if name not in people]
+        if unknown:
+            parser.error(f"not in {args.data_file}: {', '.join(unknown)}")
+        written = render_ego_maps(args.data_file, names, args.output, "." + args.format, args.layout, args.processes)
+        print(f"Rendered {len(written)} ego maps into {args.output}")
+    else:
+        print(f"Rendered {render_network(args.data_file, args.output, args.layout)}")
@@ -0,0 +1,226 @@
+import bisect
+
+from instrument import instruments
+
+NARROW_LIMIT = 50000  #Largest previous result worth filtering instead of looking up again
+REBUILD_FRACTION = 10  #The bigram index is rebuilt once changes reach this fraction of the names it covers
+REBUILD_MIN = 10000  #... or this many, whichever is more
+_NEWLINE = 10
+
+
+class BigramIndex:
+    """The names containing each pair of bytes, over the UTF-8 of the lowercased names, built in a few array passes.
+
+    Names are numbered by their position in the sorted keys given. For each
+    byte pair, postings[offsets[pair]:offsets[pair + 1]] lists the numbers
+    of the names containing it, in order. The joined text is kept as well, so
+    one byte queries are a single scan. It is built once and never changed,
+    PeopleIndex tracks the changes made since on top of it.
+    """
+
+    def __init__(self, names, keys):
+        import numpy as np  #Deferred until the first search
+
+        self.names = names
+        self.keys = keys
+        joined = "\n".join(keys)
+        if joined.isascii():
+            lengths = np.fromiter(map(len, keys), dtype=np.int64, count=len(keys))
+        else:
+            lengths = np.fromiter((len(key.encode("utf-8")) for key in keys), dtype=np.int64, count=len(keys))
+        self.text = np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+        self.starts = np.cumsum(lengths + 1) - (lengths + 1)  #Where each name begins in text
+        self.alive = np.ones(len(keys), dtype=bool)  #False for names removed since
+
+        #Every pair of bytes within a name, tagged with the name's number, sorted and deduplicated at once
+        owners = np.repeat(np.arange(len(keys), dtype=np.int32), lengths + 1)[:len(self.text)]
+        first, second = self.text[:-1], self.text[1:]
+        within = (first != _NEWLINE) & (second != _NEWLINE)
+        tagged = first[within].astype(np.int64)
+        tagged <<= 8
+        tagged |= second[within]
+        tagged <<= 32
+        tagged |= owners[:-1][within]
+        del owners, within
+        tagged.sort()
+        if len(tagged):
+            tagged = tagged[np.concatenate(([True], tagged[1:] != tagged[:-1]))]
+        self.postings = (tagged & 0xFFFFFFFF).astype(np.int32)
+        self.offsets = np.searchsorted(tagged >> 32, np.arange((1 << 16) + 1))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def number(self, name):
+        """Returns the number of name, or None if it is not one of the names indexed."""
+        key = name.lower()
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.names[i] == name:
+                return i
+            i += 1
+        return None
+
+    def lookup(self, query):
+        """Returns the sorted numbers of the names still alive containing query, which is lowercased."""
+        import numpy as np
+
+        data = query.encode("utf-8")
+        if len(data) == 1:
+            hits = np.flatnonzero(self.text == data[0])
+            numbers = np.searchsorted(self.starts, hits, side="right") - 1
+            numbers = numbers[np.concatenate(([True], numbers[1:] != numbers[:-1]))] if len(numbers) else numbers
+        else:
+            pairs = sorted({data[i] << 8 | data[i + 1] for i in range(len(data) - 1)},
+                           key=lambda pair: self.offsets[pair + 1] - self.offsets[pair])
+            #Starts from the rarest pair, so every intersection is at most that small
+            numbers = self.postings[self.offsets[pairs[0]]:self.offsets[pairs[0] + 1]]
+            for pair in pairs[1:]:
+                if not len(numbers):
+                    break
+                numbers = np.intersect1d(numbers, self.postings[self.offsets[pair]:self.offsets[pair + 1]],
+                                         assume_unique=True)
+            if len(data) > 2:
+                #Having all the pairs does not mean having them in a row
+                keys = self.keys
+                numbers = np.array([i for i in numbers.tolist() if query in keys[i]], dtype=np.int64)
+        return numbers[self.alive[numbers]]
+
+
+class SearchResults:
+    """The names matching a search in alphabetical order, made into a list only for the window asked for.
+
+    numbers are sorted positions in the index's names and added the
+    (key, name) pairs of matching names added since the index was built.
+    """
+
+    def __init__(self, index, numbers, added, limit=None):
+        self.index = index
+        self.numbers = numbers
+        self.added = added
+        #Where each added name falls among the others, counting the added ones before it
+        keys = index.keys
+        self._added_at = [bisect.bisect_right(numbers, key, key=keys.__getitem__) + i
+                          for i, (key, _) in enumerate(added)]
+        self._length = len(numbers) + len(added) if limit is None else min(limit, len(numbers) + len(added))
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("result index out of range")
+        j = bisect.bisect_left(self._added_at, index)
+        if j < len(self._added_at) and self._added_at[j] == index:
+            return self.added[j][1]
+        return self.index.names[self.numbers[index - j]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class PeopleIndex:
+    """Case-insensitive substring search over people's names.
+
+    Names are kept sorted by their lowercased form, with the lowercased keys
+    cached alongside, and updated one at a time as people are added, renamed
+    and removed. Searches look the query up in a BigramIndex, built on the
+    first search, or only narrow the previous results when the new query
+    extends the last one. Changes update the index in place: added names are
+    kept in a short sorted list searched beside it and removed ones are
+    masked out, until there are enough of them to build it again.
+    """
+
+    def __init__(self, names=()):
+        self.rebuild(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def rebuild(self, names):
+        self.names = sorted(names, key=str.lower)
+        self.keys = [name.lower() for name in self.names]
+        self._index = None
+        self._changed()
+
+    def add(self, name):
+        key = name.lower()
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.names.insert(i, name)
+        if self._index is not None:
+            bisect.insort(self._added, (key, name))
+        self._changed()
+
+    def remove(self, name):
+        key = name.lower()
+        #Names that only differ in case share a key, so the exact name is looked for among them
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.names[i] == name:
+                del self.keys[i]
+                del self.names[i]
+                self._index_removed(key, name)
+                self._changed()
+                return
+            i += 1
+
+    def rename(self, old_name, new_name):
+        self.remove(old_name)
+        self.add(new_name)
+
+    def _index_removed(self, key, name):
+        if self._index is None:
+            return
+        i = bisect.bisect_left(self._added, (key, name))
+        if i < len(self._added) and self._added[i] == (key, name):
+            del self._added[i]
+        else:
+            self._index.alive[self._index.number(name)] = False
+            self._removed += 1
+
+    def _changed(self):
+        self._last_query = None
+        self._last_results = None
+        if self._index is not None and (len(self._added) + self._removed
+                                        > max(REBUILD_MIN, len(self._index) // REBUILD_FRACTION)):
+            self._index = None  #Built again by the next search
+
+    @instruments.timed("search")
+    def search(self, query, limit=None):
+        """Returns the names containing query, ignoring case, in alphabetical order, or only the first limit of them.
+
+        The result is a sequence that only makes the names it is asked for
+        into strings, see SearchResults.
+        """
+        query = query.lower()
+        if not query:
+            self._last_query = None
+            return self.names[:limit]
+
+        if self._index is None:
+            self._index = BigramIndex(self.names.copy(), self.keys.copy())
+            self._added = []  #(key, name) for names added since the index was built, sorted
+            self._removed = 0
+
+        last = self._last_results
+        if (self._last_query and self._last_query in query
+                and len(last.numbers) + len(last.added) <= NARROW_LIMIT):
+            #Everything matching the longer query also matched the previous one
+            import numpy as np
+
+            keys = self._index.keys
+            numbers = np.array([i for i in last.numbers.tolist() if query in keys[i]], dtype=np.int64)
+            added = [(key, name) for key, name in last.added if query in key]
+        else:
+            numbers = self._index.lookup(query)
+            added = [(key, name) for key, name in self._added if query in key]
+
+        self._last_query = query
+        self._last_results = SearchResults(self._index, numbers, added)
+        return self._last_results if limit is None else SearchResults(self._index, numbers, added, limit)
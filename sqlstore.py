@@ -0,0 +1,592 @@
+"""A SQLite storage engine, for networks too large to hold in memory.
+
+The database keeps people and relationships in indexed tables and is
+written in WAL mode, so readers such as render.py work alongside the app.
+Only what is being looked at is read: a person's relationships when they
+are opened, and a page of names at a time for the people list and search.
+A network opened on a .db, .sqlite or .sqlite3 file uses it:
+
+    network = RelationshipNetwork("relationships.db")
+
+Move an existing data file, with the changes journaled since its last
+snapshot, into a new database:
+
+    python sqlstore.py relationships.json relationships.db
+"""
+import argparse
+import os
+import sqlite3
+import urllib.request
+from collections import OrderedDict
+from itertools import islice
+
+from instrument import instruments
+from persistence import SQLITE_EXTENSIONS
+
+INSERT_BATCH_SIZE = 10000  #Rows handed to each prepared bulk insert
+LOOKUP_BATCH_SIZE = 500  #Names looked up per query, below SQLite's limit on bound parameters
+LABEL_BATCH_SIZE = 200000  #Relationships read per batch when labelling groups
+PAGE_SIZE = 200  #Names fetched per query by the paged people list
+CACHED_PAGES = 16
+CACHE_KB = 64 * 1024  #SQLite page cache per connection, bulk inserts slow down once the indexes outgrow it
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS people (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE INDEX IF NOT EXISTS people_by_folded_name ON people (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS statuses (code INTEGER PRIMARY KEY, status TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS relationships (
+    person INTEGER NOT NULL, other INTEGER NOT NULL, status INTEGER NOT NULL,
+    PRIMARY KEY (person, other)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS positions (person INTEGER PRIMARY KEY, x REAL NOT NULL, y REAL NOT NULL);
+"""
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class SqliteStore:
+    """A RelationshipStore kept in a SQLite database rather than in memory.
+
+    It answers the same queries as RelationshipStore, each one a query on the
+    database. Every relationship is stored from both sides, keyed by
+    (person, other), so a person's relationships are one range of the
+    primary key. Changes are left in the open transaction until commit.
+    A read_only store opens the database read-only and as it is, for
+    sources that are only read, so reading one never changes the file.
+    """
+
+    def __init__(self, path, frozen_from=None, read_only=False):
+        self.path = path
+        self.origin = frozen_from or self  #The store people are numbered in, the live one for a frozen copy
+        self.read_only = read_only or (frozen_from is not None and frozen_from.read_only)
+        if self.read_only:
+            uri = f"file:{urllib.request.pathname2url(os.path.abspath(path))}?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(f"PRAGMA cache_size=-{CACHE_KB}")
+        self.version = 0  #Bumped on every change
+        self._edge_table = None
+        if frozen_from is not None:
+            #The first read of the transaction fixes the database it sees, the live store's changes stay out of it
+            self.connection.execute("BEGIN")
+            self.connection.execute("SELECT COUNT(*) FROM statuses").fetchone()
+            self.statuses = frozen_from.statuses.copy()
+            self.status_codes = frozen_from.status_codes.copy()
+            self.version = frozen_from.version
+            self._person_count = frozen_from._person_count
+            self.relationship_count = frozen_from.relationship_count
+            return
+
+        if read_only:
+            self._read_statuses()
+            self._count_rows()
+            return
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  #WAL stays consistent, a power cut may lose the last commit
+        self.connection.executescript(_SCHEMA)
+        self._read_statuses()
+        self._count_rows()
+
+    def _read_statuses(self):
+        self.statuses = [status for status, in self.connection.execute("SELECT status FROM statuses ORDER BY code")]
+        self.status_codes = {status: code for code, status in enumerate(self.statuses)}
+
+    def _count_rows(self):
+        #Counting is a full scan in SQLite, so the counts are kept up to date from here on
+        self._person_count, = self.connection.execute("SELECT COUNT(*) FROM people").fetchone()
+        both_sides, loops = self.connection.execute(
+            "SELECT COUNT(*), COUNT(CASE WHEN person = other THEN 1 END) FROM relationships").fetchone()
+        self.relationship_count = (both_sides + loops) // 2
+
+    def __contains__(self, name):
+        return self._id(name) is not None
+
+    def __iter__(self):
+        return (name for name, in self.connection.execute("SELECT name FROM people ORDER BY id"))
+
+    def __len__(self):
+        return self._person_count
+
+    def people(self):
+        return self
+
+    def relations(self, name):
+        """Returns {other person: status} for everyone related to name."""
+        rows = self.connection.execute(
+            "SELECT p.name, r.status FROM people AS me JOIN relationships AS r ON r.person = me.id "
+            "JOIN people AS p ON p.id = r.other WHERE me.name = ?", (name,))
+        return {other: self.statuses[code] for other, code in rows}
+
+    def status(self, u, v):
+        row = self.connection.execute(
+            "SELECT r.status FROM people AS a JOIN people AS b JOIN relationships AS r "
+            "ON r.person = a.id AND r.other = b.id WHERE a.name = ? AND b.name = ?", (u, v)).fetchone()
+        return None if row is None else self.statuses[row[0]]
+
+    def degree(self, name):
+        return self.connection.execute("SELECT COUNT(*) FROM people AS me JOIN relationships AS r "
+                                       "ON r.person = me.id WHERE me.name = ?", (name,)).fetchone()[0]
+
+    def degrees(self):
+        """Yields (name, number of relationships) for everyone."""
+        return iter(self.connection.execute(
+            "SELECT p.name, COUNT(r.other) FROM people AS p LEFT JOIN relationships AS r ON r.person = p.id "
+            "GROUP BY p.id"))
+
+    def relationships(self):
+        """Yields (u, v, status) once for every relationship."""
+        rows = self.connection.execute(
+            "SELECT a.name, b.name, r.status FROM relationships AS r JOIN people AS a ON a.id = r.person "
+            "JOIN people AS b ON b.id = r.other WHERE r.person <= r.other")
+        return ((u, v, self.statuses[code]) for u, v, code in rows)
+
+    def intern_status(self, status):
+        """Returns the shared string for status, registering it as a new category the first time."""
+        code = self.status_codes.get(status)
+        if code is None:
+            code = self.status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+            self.connection.execute("INSERT INTO statuses (code, status) VALUES (?, ?)", (code, status))
+        return self.statuses[code]
+
+    def add_person(self, name):
+        if self.connection.execute("INSERT OR IGNORE INTO people (name) VALUES (?)", (name,)).rowcount:
+            self._person_count += 1
+            self.version += 1
+
+    def add_people(self, names):
+        insert = "INSERT OR IGNORE INTO people (name) VALUES (?)"
+        for batch in _batches(names, INSERT_BATCH_SIZE):
+            self._person_count += self.connection.executemany(insert, ((name,) for name in batch)).rowcount
+        self.version += 1
+
+    def rename_person(self, old_name, new_name):
+        """Renames a person, their relationships follow by id. Returns False if it cannot be done."""
+        if old_name not in self or new_name in self:
+            return False
+
+        self.connection.execute("UPDATE people SET name = ? WHERE name = ?", (new_name, old_name))
+        self.version += 1
+        return True
+
+    def remove_person(self, name):
+        person = self._id(name)
+        if person is None:
+            return False
+
+        degree = self.connection.execute("SELECT COUNT(*) FROM relationships WHERE person = ?", (person,)).fetchone()[0]
+        self.connection.execute("DELETE FROM relationships WHERE other = ?1 AND person IN "
+                                "(SELECT other FROM relationships WHERE person = ?1)", (person,))
+        self.connection.execute("DELETE FROM relationships WHERE person = ?", (person,))
+        self.connection.execute("DELETE FROM positions WHERE person = ?", (person,))
+        self.connection.execute("DELETE FROM people WHERE id = ?", (person,))
+        self._person_count -= 1
+        self.relationship_count -= degree
+        self.version += 1
+        return True
+
+    def set_relationship(self, u, v, status):
+        code = self.status_codes[self.intern_status(status)]
+        self.add_person(u)
+        self.add_person(v)
+        a, b = self._id(u), self._id(v)
+        if self.status(u, v) is None:
+            self.relationship_count += 1
+        rows = [(a, b, code)] if a == b else [(a, b, code), (b, a, code)]
+        self.connection.executemany("INSERT OR REPLACE INTO relationships (person, other, status) VALUES (?, ?, ?)",
+                                    rows)
+        self.version += 1
+
+    def add_relationships(self, relationships):
+        """Bulk inserts relationships, adding the people in them, with one prepared statement per batch."""
+        insert = "INSERT OR IGNORE INTO relationships (person, other, status) VALUES (?, ?, ?)"
+        update = "UPDATE relationships SET status = ?3 WHERE person = ?1 AND other = ?2"
+        for batch in _batches(relationships, INSERT_BATCH_SIZE):
+            codes = [self.status_codes[self.intern_status(status)] for _, _, status in batch]
+            names = list(dict.fromkeys(name for u, v, _ in batch for name in (u, v)))
+            ids = self._ids(names)
+            new_people = [name for name in names if name not in ids]
+            if new_people:
+                self.add_people(new_people)
+                ids.update(self._ids(new_people))
+            rows = []
+            loops = []
+            for (u, v, _), code in zip(batch, codes):
+                a, b = ids[u], ids[v]
+                if a == b:
+                    loops.append((a, a, code))
+                else:
+                    rows.append((a, b, code))
+                    rows.append((b, a, code))
+            #Inserting first counts the new relationships, any that were already there then get their last status.
+            #The inserts go in key order, which keeps the writes to the primary key together
+            inserted = self.connection.executemany(insert, sorted(rows)).rowcount
+            inserted_loops = self.connection.executemany(insert, loops).rowcount
+            self.relationship_count += inserted // 2 + inserted_loops
+            if inserted + inserted_loops < len(rows) + len(loops):
+                self.connection.executemany(update, rows + loops)
+        self.version += 1
+
+    def remove_relationship(self, u, v):
+        a, b = self._id(u), self._id(v)
+        if a is None or b is None:
+            return False
+        removed = self.connection.execute("DELETE FROM relationships WHERE (person = ?1 AND other = ?2) "
+                                          "OR (person = ?2 AND other = ?1)", (a, b)).rowcount
+        if not removed:
+            return False
+
+        self.relationship_count -= 1
+        self.version += 1
+        return True
+
+    def subgraph(self, names):
+        """Returns an in-memory RelationshipStore with only the given people and the relationships between them."""
+        from store import RelationshipStore
+
+        sub = RelationshipStore()
+        for status in self.statuses:
+            sub.intern_status(status)
+        names = [name for name in dict.fromkeys(names) if name in self]
+        sub.add_people(names)
+        wanted = set(names)
+        sub.add_relationships((name, other, status) for name in names
+                              for other, status in self.relations(name).items() if other in wanted)
+        return sub
+
+    def clear(self):
+        self.connection.execute("DELETE FROM relationships")
+        self.connection.execute("DELETE FROM positions")
+        self.connection.execute("DELETE FROM people")
+        self._person_count = 0
+        self.relationship_count = 0
+        self.version += 1
+
+    def freeze(self):
+        """Returns a read-only copy of the store as committed now, on its own connection, for reading on another thread.
+
+        Must be called under the lock guarding the store's changes, which are
+        committed before it is released.
+        """
+        return SqliteStore(self.path, frozen_from=self)
+
+    def edge_table(self):
+        """Returns the relationships as an EdgeTable, streamed out of the database and cached until the next change."""
+        if self._edge_table is None or self._edge_table[0] != self.version:
+            self._edge_table = (self.version, self._build_edge_table())
+        return self._edge_table[1]
+
+    def _build_edge_table(self):
+        import numpy as np
+
+        from store import EdgeTable
+
+        people = self.connection.execute("SELECT id, name FROM people ORDER BY id").fetchall()
+        ids = np.array([person for person, _ in people], dtype=np.int64)
+        names = [name for _, name in people]
+        rows = self.connection.execute("SELECT person, other, status FROM relationships WHERE person <= other")
+        #Fetched in batches so only one batch of rows is ever held as Python tuples
+        chunks = [np.empty((0, 3), dtype=np.int64)]
+        while True:
+            batch = rows.fetchmany(INSERT_BATCH_SIZE)
+            if not batch:
+                break
+            chunks.append(np.array(batch, dtype=np.int64))
+        edges = np.concatenate(chunks)
+        #Ids can have gaps after removals, people are numbered by their position in id order instead
+        src = np.searchsorted(ids, edges[:, 0]).astype(np.int32)
+        dst = np.searchsorted(ids, edges[:, 1]).astype(np.int32)
+        codes = edges[:, 2].astype(np.uint8 if len(self.statuses) <= 256 else np.int32)
+        return EdgeTable(names, src, dst, codes, tuple(self.statuses))
+
+    def numbered_edges(self):
+        """Returns (numbers, people, edges) for labelling groups, numbering people by their database id.
+
+        Only the ids are read, people's numbers are looked up by name when
+        asked for and the relationships are streamed in batches, so no name
+        is held in memory.
+        """
+        import numpy as np
+
+        people = np.fromiter((person for person, in self.connection.execute("SELECT id FROM people")),
+                             dtype=np.int64, count=len(self))
+        return SqlitePersonNumbers(self.origin), people, self._id_batches()
+
+    def _id_batches(self):
+        import numpy as np
+
+        rows = self.connection.execute("SELECT person, other FROM relationships WHERE person < other")
+        while True:
+            batch = rows.fetchmany(LABEL_BATCH_SIZE)
+            if not batch:
+                return
+            pairs = np.array(batch, dtype=np.int64)
+            yield pairs[:, 0], pairs[:, 1]
+
+    def to_networkx(self):
+        """Builds an undirected networkx graph with a status attribute on every edge, for layout and drawing."""
+        import networkx as nx
+
+        graph = nx.Graph()
+        graph.add_nodes_from(self)
+        graph.add_edges_from((u, v, {"status": status}) for u, v, status in self.relationships())
+        return graph
+
+    def load_positions(self):
+        rows = self.connection.execute("SELECT p.name, x, y FROM positions JOIN people AS p ON p.id = person")
+        return {name: (x, y) for name, x, y in rows}
+
+    def save_positions(self, positions):
+        self.connection.execute("DELETE FROM positions")
+        self.connection.executemany("INSERT INTO positions (person, x, y) SELECT id, ?, ? FROM people WHERE name = ?",
+                                    ((x, y, name) for name, (x, y) in positions.items()))
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        """Drops the changes made since the last commit."""
+        self.connection.rollback()
+        self._read_statuses()
+        self._count_rows()
+        self.version += 1
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def _id(self, name):
+        row = self.connection.execute("SELECT id FROM people WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def _ids(self, names):
+        ids = {}
+        for batch in _batches(names, LOOKUP_BATCH_SIZE):
+            ids.update(self.connection.execute(
+                f"SELECT name, id FROM people WHERE name IN ({', '.join('?' * len(batch))})", batch))
+        return ids
+
+
+class SqlitePersonNumbers:
+    """The PersonNumbers of a SqliteStore: each person's database id, looked up when asked for.
+
+    Ids never change on a rename, so nothing needs to be kept in step.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, name):
+        person = self.store._id(name)
+        if person is None:
+            raise KeyError(name)
+        return person
+
+    def add(self, name):
+        return self[name]
+
+    def rename(self, old_name, new_name):
+        pass
+
+    def name(self, number):
+        return self.store.connection.execute("SELECT name FROM people WHERE id = ?", (number,)).fetchone()[0]
+
+
+class PagedNames:
+    """The names matching a search, read from the database a page at a time as they are indexed.
+
+    It is a read-only sequence, so VirtualListbox can show it directly:
+    scrolling only fetches the pages in view, and len is one COUNT query.
+    """
+
+    def __init__(self, store, query, limit=None):
+        self.connection = store.connection
+        self.limit = limit
+        if query:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            self.where, self.params = "WHERE name LIKE ? ESCAPE '\\'", (f"%{escaped}%",)
+        else:
+            self.where, self.params = "", ()
+        self._length = None
+        self._pages = OrderedDict()  #Page number -> names, least recently used first
+
+    def __len__(self):
+        if self._length is None:
+            count, = self.connection.execute(f"SELECT COUNT(*) FROM people {self.where}", self.params).fetchone()
+            self._length = count if self.limit is None else min(count, self.limit)
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("name index out of range")
+        return self._page(index // PAGE_SIZE)[index % PAGE_SIZE]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _page(self, number):
+        page = self._pages.get(number)
+        if page is None:
+            rows = self.connection.execute(
+                f"SELECT name FROM people {self.where} ORDER BY name COLLATE NOCASE LIMIT ? OFFSET ?",
+                (*self.params, PAGE_SIZE, number * PAGE_SIZE))
+            page = self._pages[number] = [name for name, in rows]
+            if len(self._pages) > CACHED_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(number)
+        return page
+
+
+class SqlitePeopleIndex:
+    """The PeopleIndex of a SqliteStore, searching the database instead of a copy of every name.
+
+    The database keeps itself up to date, so the change hooks do nothing.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def rebuild(self, names):
+        pass
+
+    def add(self, name):
+        pass
+
+    def remove(self, name):
+        pass
+
+    def rename(self, old_name, new_name):
+        pass
+
+    @instruments.timed("search")
+    def search(self, query, limit=None):
+        """Returns the names containing query, ignoring case, in alphabetical order, as PagedNames."""
+        return PagedNames(self.store, query, limit)
+
+
+class SqliteBackend:
+    """Keeps a RelationshipNetwork in a SQLite database, committing each change as it is made.
+
+    Every commit is durable on its own, so there is no journal to replay and
+    no snapshot to write; saving only stores the map positions.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.store = SqliteStore(path, read_only=read_only)
+        self.people_index = SqlitePeopleIndex(self.store)
+        self.positions_dirty = False
+
+    def load(self):
+        """Returns (positions, changes to replay)."""
+        return self.store.load_positions(), []
+
+    def record(self, op, args):
+        self.store.commit()
+
+    def rolled_back(self):
+        #The undone changes already restored every row, committing also keeps statuses first seen in the batch
+        self.store.commit()
+
+    def mark_dirty(self):
+        self.positions_dirty = True
+
+    def imported(self):
+        #clear emptied the positions table, the ones now in the layout are written by the next save
+        self.store.commit()
+        self.mark_dirty()
+        return None
+
+    def import_abandoned(self, network):
+        #The import was left in the open transaction, dropping it leaves the database as it was before
+        with network.lock:
+            self.store.rollback()
+
+    def request_save(self, network):
+        pass
+
+    def save(self, network):
+        with network.lock:
+            if not self.positions_dirty or network.importing:
+                return None  #Committing would keep half an import, which stays in the open transaction until it is whole
+            self.store.save_positions(network.layout.positions)
+            self.store.commit()
+            self.positions_dirty = False
+        return {"people": len(self.store), "relationships": self.store.relationship_count}
+
+    def start_writer(self, network, on_saved=None, on_error=None):
+        pass
+
+    def close(self, network):
+        self.save(network)
+        self.store.close()
+
+
+def write_database(path, nodes, edges, positions=None):
+    """Replaces the contents of the database at path with nodes, edges and their map positions."""
+    store = SqliteStore(path)
+    try:
+        store.clear()
+        store.add_people(nodes)
+        store.add_relationships(edges)
+        store.save_positions(positions or {})
+    finally:
+        store.close()
+    return store
+
+
+def read_database(store, path):
+    """Adds the people and relationships in the database at path to store and returns {"positions": ...}."""
+    source = SqliteStore(path, read_only=True)
+    try:
+        store.add_people(source.people())
+        store.add_relationships(source.relationships())
+        return {"positions": source.load_positions()}
+    finally:
+        source.close()
+
+
+def migrate(source, target):
+    """Copies the network in a data file, with the changes journaled since its snapshot, into a new database.
+
+    Returns the number of people and relationships copied.
+    """
+    from core import RelationshipNetwork
+
+    if os.path.exists(target):
+        raise FileExistsError(f"{target} already exists")
+
+    network = RelationshipNetwork(source)
+    network.load()
+    database = write_database(target, network.store.people(), network.store.relationships(), network.layout.positions)
+    return len(database), database.relationship_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="the .json, .jsonl or .rmap data file to migrate")
+    parser.add_argument("target", help="the database to create, a .db, .sqlite or .sqlite3 file")
+    args = parser.parse_args()
+    if not args.target.lower().endswith(SQLITE_EXTENSIONS):
+        parser.error(f"{args.target} is not a {', '.join(SQLITE_EXTENSIONS)} file")
+
+    try:
+        people, relationships = migrate(args.source, args.target)
+    except FileExistsError as e:
+        parser.error(str(e))
+    print(f"Migrated {people} people and {relationships} relationships into {args.target}")
@@ -0,0 +1,311 @@
+import threading
+import weakref
+from itertools import chain
+
+
+class EdgeTable:
+    """Every relationship once, as NumPy arrays partitioned by status.
+
+    People are numbered in store order and statuses by their category code.
+    src, dst and codes hold one entry per relationship; order lists the
+    relationship ids grouped by status, with the ids of status code c in
+    order[status_starts[c]:status_starts[c + 1]], CSR style. Filtering by
+    status, counting and colouring are then array operations.
+    """
+
+    def __init__(self, names, src, dst, codes, statuses):
+        import numpy as np
+
+        self.names = names
+        self.src = src
+        self.dst = dst
+        self.codes = codes
+        self.statuses = statuses  #Code -> status
+        self.order = np.argsort(codes, kind="stable")
+        self.status_starts = np.searchsorted(codes[self.order], np.arange(len(statuses) + 1))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def with_status(self, *statuses):
+        """Returns the ids of the relationships with any of the given statuses, in id order."""
+        import numpy as np
+
+        codes = [self.statuses.index(status) for status in statuses if status in self.statuses]
+        ids = [self.order[self.status_starts[code]:self.status_starts[code + 1]] for code in codes]
+        return np.sort(np.concatenate(ids)) if ids else np.empty(0, dtype=np.intp)
+
+    def counts(self):
+        """Returns {status: number of relationships}."""
+        sizes = self.status_starts[1:] - self.status_starts[:-1]
+        return {status: int(size) for status, size in zip(self.statuses, sizes) if size}
+
+
+class PersonNumbers(dict):
+    """Numbers people for NetworkAnalytics's union-find, in the order of the names given, new people last."""
+
+    def __init__(self, names=()):
+        self.names = list(names)  #By number
+        super().__init__((name, i) for i, name in enumerate(self.names))
+
+    def add(self, name):
+        number = self[name] = len(self.names)
+        self.names.append(name)
+        return number
+
+    def rename(self, old_name, new_name):
+        number = self[new_name] = self.pop(old_name)
+        self.names[number] = new_name
+
+    def name(self, number):
+        return self.names[number]
+
+
+class RelationshipsView:
+    """Every relationship of a store once, as (u, v, status), sized and iterable any number of times."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store.relationship_count
+
+    def __iter__(self):
+        return self.store.relationships()
+
+
+class RelationshipStore:
+    """The people in the network and the status of the relationship between each pair of them.
+
+    Relationships are undirected and stored once, in an adjacency map from each
+    person to {other person: status}, so the same data backs per-person
+    listings, pair lookups and the whole-network views. Statuses are interned
+    as categories, so every relationship with the same status shares one
+    string and has a small-integer code for the array views in edge_table.
+
+    freeze hands out read-only copies that share the {other person: status}
+    dicts copy-on-write: while a frozen copy is alive, the first change to a
+    person's dict since it was taken replaces the dict with a copy instead of
+    changing the one the frozen copy reads.
+    """
+
+    def __init__(self):
+        self.adjacency = {}
+        self.relationship_count = 0
+        self.status_codes = {}  #Status -> category code, in order of first use
+        self.statuses = []  #Category code -> status
+        self.version = 0  #Bumped on every change
+        self._edge_table = None
+        self._shared = False  #True while a frozen copy may share neighbour dicts with the store
+        self._owned = set()  #People whose neighbour dict was copied since the last freeze
+        self._frozen_count = 0
+        self._frozen_lock = threading.Lock()  #Frozen copies are released on whichever thread drops them
+
+    def __contains__(self, name):
+        return name in self.adjacency
+
+    def __iter__(self):
+        return iter(self.adjacency)
+
+    def __len__(self):
+        return len(self.adjacency)
+
+    def people(self):
+        return self.adjacency.keys()
+
+    def relations(self, name):
+        """Returns {other person: status} for everyone related to name. The dict must not be modified."""
+        return self.adjacency.get(name, {})
+
+    def status(self, u, v):
+        return self.adjacency.get(u, {}).get(v)
+
+    def degree(self, name):
+        return len(self.adjacency.get(name, ()))
+
+    def degrees(self):
+        """Yields (name, number of relationships) for everyone."""
+        return ((name, len(neighbours)) for name, neighbours in self.adjacency.items())
+
+    def relationships(self):
+        """Yields (u, v, status) once for every relationship."""
+        seen = set()
+        for u, neighbours in self.adjacency.items():
+            for v, status in neighbours.items():
+                if v not in seen:
+                    yield u, v, status
+            seen.add(u)
+
+    def intern_status(self, status):
+        """Returns the shared string for status, registering it as a new category the first time."""
+        code = self.status_codes.get(status)
+        if code is None:
+            code = self.status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return self.statuses[code]
+
+    def add_person(self, name):
+        if name not in self.adjacency:
+            self.adjacency[name] = {}
+            self.version += 1
+
+    def add_people(self, names):
+        for name in names:
+            if name not in self.adjacency:
+                self.adjacency[name] = {}
+        self.version += 1
+
+    def rename_person(self, old_name, new_name):
+        """Renames a person in place, touching only their neighbours. Returns False if it cannot be done."""
+        if old_name not in self.adjacency or new_name in self.adjacency:
+            return False
+
+        if self._shared:
+            self._unshare(old_name, *self.adjacency[old_name])
+            self._owned.add(new_name)
+        neighbours = self.adjacency.pop(old_name)
+        if old_name in neighbours:
+            neighbours[new_name] = neighbours.pop(old_name)
+        self.adjacency[new_name] = neighbours
+        for other in neighbours:
+            if other != new_name:
+                other_neighbours = self.adjacency[other]
+                other_neighbours[new_name] = other_neighbours.pop(old_name)
+        self.version += 1
+        return True
+
+    def remove_person(self, name):
+        neighbours = self.adjacency.pop(name, None)
+        if neighbours is None:
+            return False
+
+        if self._shared:
+            self._unshare(*(other for other in neighbours if other != name))
+
+        for other in neighbours:
+            if other != name:
+                del self.adjacency[other][name]
+        self.relationship_count -= len(neighbours)
+        self.version += 1
+        return True
+
+    def set_relationship(self, u, v, status):
+        status = self.intern_status(status)
+        self.add_person(u)
+        self.add_person(v)
+        if self._shared:
+            self._unshare(u, v)
+        if v not in self.adjacency[u]:
+            self.relationship_count += 1
+        self.adjacency[u][v] = status
+        self.adjacency[v][u] = status
+        self.version += 1
+
+    def add_relationships(self, relationships):
+        for u, v, status in relationships:
+            self.set_relationship(u, v, status)
+
+    def remove_relationship(self, u, v):
+        if v not in self.adjacency.get(u, {}):
+            return False
+
+        if self._shared:
+            self._unshare(u, v)
+        del self.adjacency[u][v]
+        self.adjacency[v].pop(u, None)
+        self.relationship_count -= 1
+        self.version += 1
+        return True
+
+    def subgraph(self, names):
+        """Returns a new store with only the given people and the relationships between them."""
+        names = set(names) & self.adjacency.keys()
+        sub = RelationshipStore()
+        for status in self.statuses:
+            sub.intern_status(status)
+        for name in names:
+            neighbours = {other: status for other, status in self.adjacency[name].items() if other in names}
+            sub.adjacency[name] = neighbours
+            sub.relationship_count += len(neighbours) + (name in neighbours)
+        sub.relationship_count //= 2
+        return sub
+
+    def clear(self):
+        self.adjacency.clear()
+        self.relationship_count = 0
+        self.version += 1
+
+    def freeze(self):
+        """Returns a read-only copy of the store as it is now, for reading on another thread without the lock.
+
+        Only the map of people is copied, the neighbour dicts are shared until
+        the store next changes them. Must be called under the lock guarding
+        the store's changes.
+        """
+        frozen = RelationshipStore()
+        frozen.adjacency = self.adjacency.copy()
+        frozen.relationship_count = self.relationship_count
+        frozen.status_codes = self.status_codes.copy()
+        frozen.statuses = self.statuses.copy()
+        frozen.version = self.version
+        with self._frozen_lock:
+            self._frozen_count += 1
+            self._shared = True
+            self._owned = set()  #Every dict is shared with the new copy, whoever copied it before
+        weakref.finalize(frozen, self._release_frozen)
+        return frozen
+
+    def _release_frozen(self):
+        with self._frozen_lock:
+            self._frozen_count -= 1
+            if not self._frozen_count:
+                self._shared = False
+
+    def _unshare(self, *names):
+        #Copies the neighbour dicts a frozen copy may still be reading before they are changed
+        for name in names:
+            if name not in self._owned:
+                self.adjacency[name] = dict(self.adjacency[name])
+                self._owned.add(name)
+
+    def edge_table(self):
+        """Returns the relationships as an EdgeTable, cached until the next change."""
+        if self._edge_table is None or self._edge_table[0] != self.version:
+            self._edge_table = (self.version, self._build_edge_table())
+        return self._edge_table[1]
+
+    def _build_edge_table(self):
+        import numpy as np
+
+        names = list(self.adjacency)
+        index = {name: i for i, name in enumerate(names)}
+        neighbours = self.adjacency.values()
+        degrees = np.fromiter(map(len, neighbours), dtype=np.int32, count=len(names))
+        src = np.repeat(np.arange(len(names), dtype=np.int32), degrees)
+        dst = np.fromiter(map(index.__getitem__, chain.from_iterable(neighbours)), dtype=np.int32, count=len(src))
+        codes = np.fromiter(map(self.status_codes.__getitem__, chain.from_iterable(map(dict.values, neighbours))),
+                            dtype=np.uint8 if len(self.statuses) <= 256 else np.int32, count=len(src))
+        #Both sides of every relationship are in the adjacency, only the one from the lower numbered person is kept
+        once = src <= dst
+        return EdgeTable(names, src[once], dst[once], codes[once], tuple(self.statuses))
+
+    def numbered_edges(self):
+        """Returns (numbers, people, edges) for labelling groups.
+
+        numbers is a PersonNumbers, people every person's number as a NumPy
+        array and edges the relationships as batches of (src, dst) arrays of
+        numbers, here a single batch from edge_table.
+        """
+        import numpy as np
+
+        table = self.edge_table()
+        return PersonNumbers(table.names), np.arange(len(table.names)), [(table.src, table.dst)]
+
+    def to_networkx(self):
+        """Builds an undirected networkx graph with a status attribute on every edge, for layout and drawing."""
+        import networkx as nx  #Deferred, only maps need networkx
+
+        graph = nx.Graph()
+        graph.add_nodes_from(self.adjacency)
+        graph.add_edges_from((u, v, {"status": status}) for u, v, status in self.relationships())
+        return graph
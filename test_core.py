@@ -0,0 +1,97 @@
+import pytest
+
+from core import BATCH_REINDEX_LIMIT, IMPORT_BATCH_SIZE, BatchError, RelationshipNetwork
+
+
+@pytest.fixture(params=[".json", ".db"])
+def network(request, tmp_path):
+    network = RelationshipNetwork(str(tmp_path / ("relationships" + request.param)))
+    network.load()
+    network.apply_batch([("add_person", "Alice"), ("add_person", "Bob"), ("add_person", "Carol"),
+                         ("set_relationship", "Alice", "Bob", "Friend"),
+                         ("set_relationship", "Bob", "Carol", "Dislike")])
+    yield network
+    network.close()
+
+
+def state(network):
+    #Relationships are undirected, so restoring someone may store a pair the other way round
+    relationships = {(frozenset((u, v)), status) for u, v, status in network.store.relationships()}
+    return (sorted(network.store.people()), relationships,
+            list(network.people_index.search("")))
+
+
+def test_batch_applies_every_change(network):
+    count = network.apply_batch([("rename_person", "Carol", "Dave"), ("remove_relationship", "Alice", "Bob"),
+                                 ("set_relationship", "Alice", "Eve", "Together")])
+    assert count == 3
+    assert sorted(network.store.people()) == ["Alice", "Bob", "Dave", "Eve"]
+    assert network.store.status("Bob", "Dave") == "Dislike"
+    assert network.store.status("Alice", "Bob") is None
+    assert network.people_index.search("e")[:] == ["Alice", "Dave", "Eve"]
+
+
+def test_failed_batch_leaves_the_network_untouched(network):
+    before = state(network)
+    with pytest.raises(BatchError) as error:
+        network.apply_batch([("set_relationship", "Alice", "Carol", "Together"), ("remove_person", "Bob"),
+                             ("rename_person", "Alice", "Zed"), ("add_person", "Carol")])
+    assert error.value.position == 3
+    assert state(network) == before
+    assert network.store.status("Alice", "Bob") == "Friend"
+
+
+def test_failed_large_batch_rebuilds_the_index(network):
+    before = state(network)
+    changes = [("add_person", f"Person {i}") for i in range(BATCH_REINDEX_LIMIT + 1)] + [("remove_person", "Nobody")]
+    with pytest.raises(BatchError):
+        network.apply_batch(changes)
+    assert state(network) == before
+
+
+def test_malformed_batch_is_rejected_before_anything_is_applied(network):
+    before = state(network)
+    with pytest.raises(BatchError, match="unknown status"):
+        network.apply_batch([("add_person", "Dave"), ("set_relationship", "Alice", "Dave", "Rival")])
+    assert state(network) == before
+
+
+def test_rolled_back_batch_is_not_recovered(network):
+    with pytest.raises(BatchError):
+        network.apply_batch([("add_person", "Dave"), ("add_person", "Alice")])
+    network.commit_change("add_person", "Eve")
+    #Reopened without closing, as after a crash
+    recovered = RelationshipNetwork(network.data_file)
+    recovered.load()
+    assert sorted(recovered.store.people()) == ["Alice", "Bob", "Carol", "Eve"]
+
+
+@pytest.mark.parametrize("merge", [False, True])
+def test_failed_import_puts_the_network_back(network, monkeypatch, merge):
+    from importer import ImportData, ImportReport
+
+    before = state(network)
+    names = [f"Person {i}" for i in range(3 * IMPORT_BATCH_SIZE)]
+    data = ImportData(names, {("Alice", "Person 1"): "Friend"}, {}, ImportReport("import.json"))
+
+    def fail(relationships):
+        raise OSError("disk full")
+
+    #Fails once the people are in
+    monkeypatch.setattr(network.store, "add_relationships", fail)
+    with pytest.raises(OSError):
+        network.apply_import(data, merge)
+    monkeypatch.undo()
+    assert state(network) == before
+    assert not network.importing
+
+    #Abandoning the steps partway does the same
+    steps = network.import_steps(ImportData(names, {}, {}, ImportReport("import.json")), merge)
+    next(steps)
+    steps.close()
+    assert state(network) == before
+
+    network.commit_change("add_person", "Dave")
+    recovered = RelationshipNetwork(network.data_file)
+    recovered.load()
+    assert sorted(recovered.store.people()) == ["Alice", "Bob", "Carol", "Dave"]
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import importer
+from core import RelationshipNetwork
+from importer import InvalidDataError, read_import
+
+NODES = ["Alice", "Bob", "Carol", "", 7]
+EDGES = [["Alice", "Bob", "Friend"],
+         ["Bob", "Alice", "Friend"],  #The reversed copy older exports wrote
+         ["Carol", "Bob", "Dislike"],
+         ["Bob", "Carol", "Likes"],  #Conflicts, the first status is kept
+         ["Alice", "Dave", "Exes"],  #Dave is undeclared
+         ["Alice", "Bob"],
+         ["Alice", "Eve", "Rival"]]
+
+
+def write_json(path):
+    path.write_text(json.dumps({"nodes": NODES, "edges": EDGES, "positions": {"Alice": [1, 2], "Bob": "here"}}))
+    return str(path)
+
+
+def write_jsonl(path):
+    rows = [["node", node] for node in NODES] + [["edge", *edge] for edge in EDGES]
+    lines = [json.dumps(row) for row in rows] + ["not json", json.dumps({"node": "Zed"}), json.dumps(["node"])]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def check(data):
+    assert data.names == ["Alice", "Bob", "Carol", "Dave"]
+    assert data.relationships == {("Alice", "Bob"): "Friend", ("Bob", "Carol"): "Dislike",
+                                  ("Alice", "Dave"): "Exes"}
+    report = data.report
+    assert (report.duplicates, report.conflicts, report.undeclared) == (1, 1, 1)
+    assert (report.people, report.relationships) == (4, 3)
+
+
+@pytest.fixture(params=[None, 2])
+def chunk_size(request, monkeypatch):
+    #Small chunks reconcile the file across many of them, as large files are
+    if request.param is not None:
+        monkeypatch.setattr(importer, "IMPORT_CHUNK_SIZE", request.param)
+        monkeypatch.setattr(importer, "LINE_CHUNK_BYTES", 16)
+    return request.param
+
+
+def test_json_import_is_reconciled(tmp_path, chunk_size):
+    data = read_import(write_json(tmp_path / "data.json"))
+    check(data)
+    assert data.positions == {"Alice": (1, 2)}
+    assert data.report.invalid == 5  #Two people, two relationships and a position
+
+
+def test_jsonl_import_is_reconciled(tmp_path, chunk_size):
+    data = read_import(write_jsonl(tmp_path / "data.jsonl"))
+    check(data)
+    assert data.report.invalid == 7  #Two people, two relationships and three malformed rows
+
+
+def test_jsonl_import_over_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, "LINE_CHUNK_BYTES", 64)
+    path = write_jsonl(tmp_path / "data.jsonl")
+    sequential = read_import(path, processes=0)
+    pooled = read_import(path, processes=2)
+    check(pooled)
+    assert pooled.report.invalid == sequential.report.invalid
+    assert pooled.report.problems == sequential.report.problems
+
+
+def test_strict_import_raises(tmp_path):
+    with pytest.raises(InvalidDataError) as error:
+        read_import(write_json(tmp_path / "data.json"), strict=True)
+    assert error.value.report.conflicts == 1
+
+
+def test_merge_counts_what_changed(tmp_path):
+    network = RelationshipNetwork(str(tmp_path / "relationships.json"))
+    network.load()
+    network.apply_batch([("set_relationship", "Alice", "Bob", "Friend"), ("set_relationship", "Bob", "Carol", "Likes")])
+    report = network.apply_import(read_import(write_json(tmp_path / "data.json")), merge=True)
+
+    assert (report.people_added, report.relationships_added, report.relationships_updated) == (1, 1, 1)
+    assert network.store.status("Carol", "Bob") == "Dislike"
+    assert network.layout.positions["Alice"] == (1, 2)
+    network.close()
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from core import RelationshipNetwork
+from persistence import BARRIER, ChangeJournal
+
+
+def open_network(path):
+    network = RelationshipNetwork(str(path))
+    network.load()
+    return network
+
+
+def test_replay_returns_entries_after_the_snapshot(tmp_path):
+    journal = ChangeJournal(str(tmp_path / "x.journal"))
+    journal.write([(journal.next_seq(), "add_person", ("Alice",)), (journal.next_seq(), "add_person", ("Bob",)),
+                   (journal.next_seq(), "set_relationship", ("Alice", "Bob", "Friend"))])
+    journal.close()
+
+    replayed = ChangeJournal(journal.path)
+    assert replayed.replay(1) == [("add_person", ["Bob"]), ("set_relationship", ["Alice", "Bob", "Friend"])]
+    assert replayed.seq == 3
+
+
+def test_replay_truncates_a_torn_tail(tmp_path):
+    path = tmp_path / "x.journal"
+    good = json.dumps([1, "add_person", "Alice"]) + "\n"
+    path.write_text(good + '[2, "add_person", "Bo')
+
+    journal = ChangeJournal(str(path))
+    assert journal.replay() == [("add_person", ["Alice"])]
+    assert path.read_text() == good
+
+    #Appends start on a clean line
+    journal.write([(journal.next_seq(), "add_person", ("Bob",))])
+    journal.close()
+    assert ChangeJournal(str(path)).replay() == [("add_person", ["Alice"]), ("add_person", ["Bob"])]
+
+
+def test_replay_stops_at_a_barrier_newer_than_the_snapshot(tmp_path):
+    path = tmp_path / "x.journal"
+    lines = [[1, "add_person", "Alice"], [2, BARRIER], [3, "add_person", "Bob"]]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+
+    assert ChangeJournal(str(path)).replay() == [("add_person", ["Alice"])]
+    assert path.read_text() == json.dumps(lines[0]) + "\n"
+
+    #A barrier the snapshot already covers is skipped like any other entry
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    assert ChangeJournal(str(path)).replay(2) == [("add_person", ["Bob"])]
+
+
+def test_compact_keeps_entries_after_the_snapshot(tmp_path):
+    journal = ChangeJournal(str(tmp_path / "x.journal"))
+    journal.write([(journal.next_seq(), "add_person", (name,)) for name in ("Alice", "Bob", "Carol")])
+    journal.compact(2)
+    assert ChangeJournal(journal.path).replay() == [("add_person", ["Carol"])]
+
+    journal.compact(3)
+    assert ChangeJournal(journal.path).replay() == []
+
+
+def test_changes_survive_a_crash(tmp_path):
+    path = tmp_path / "relationships.json"
+    network = open_network(path)
+    network.commit_change("add_person", "Alice")
+    network.commit_change("add_person", "Bob")
+    network.save()
+    network.commit_change("set_relationship", "Alice", "Bob", "Friend")
+    network.commit_change("rename_person", "Bob", "Robert")
+    #Never closed, as if the process died: only the snapshot and the journal are on disk
+
+    recovered = open_network(path)
+    assert sorted(recovered.store.people()) == ["Alice", "Robert"]
+    assert recovered.store.status("Alice", "Robert") == "Friend"
+    assert recovered.people_index.search("rob")[:] == ["Robert"]
+
+
+def test_close_writes_a_snapshot_and_empties_the_journal(tmp_path):
+    path = tmp_path / "relationships.json"
+    network = open_network(path)
+    network.commit_change("add_person", "Alice")
+    network.close()
+
+    assert (tmp_path / "relationships.journal").read_text() == ""
+    assert list(open_network(path).store.people()) == ["Alice"]
+
+
+def test_a_crash_before_the_import_snapshot_recovers_the_old_network(tmp_path):
+    from importer import ImportData, ImportReport
+
+    path = tmp_path / "relationships.json"
+    network = open_network(path)
+    network.commit_change("add_person", "Old")
+    network.save()
+    network.backend.request_save = lambda network: None  #The snapshot after the import is never written
+    network.apply_import(ImportData(["New"], {}, {}, ImportReport("import.json")))
+    network.commit_change("add_person", "Later")
+
+    recovered = open_network(path)
+    assert list(recovered.store.people()) == ["Old"]
+
+
+def test_writer_close_gives_up_after_the_timeout(tmp_path):
+    import threading
+
+    from persistence import BackgroundWriter
+
+    stuck = threading.Event()
+    journal = ChangeJournal(str(tmp_path / "x.journal"))
+    writer = BackgroundWriter(journal, save=lambda: {}, on_saved=lambda snapshot: stuck.wait())
+    assert writer.close(timeout=0.2) is False
+    stuck.set()
+    writer.thread.join()
+
+
+@pytest.mark.parametrize("extension", [".json", ".jsonl", ".rmap", ".db"])
+def test_snapshot_round_trip(tmp_path, extension):
+    path = tmp_path / ("relationships" + extension)
+    network = open_network(path)
+    network.apply_batch([("set_relationship", "Alice", "Bob", "Friend"), ("set_relationship", "Bob", "Carol", "Exes"),
+                         ("add_person", "Dave")])
+    network.layout.update({"Alice": (1.0, 2.0)})
+    network.backend.mark_dirty()
+    network.close()
+
+    reopened = open_network(path)
+    assert sorted(reopened.store.people()) == ["Alice", "Bob", "Carol", "Dave"]
+    assert sorted((*sorted((u, v)), status) for u, v, status in reopened.store.relationships()) == \
+        [("Alice", "Bob", "Friend"), ("Bob", "Carol", "Exes")]
+    assert reopened.layout.positions["Alice"] == (1.0, 2.0)
+    reopened.close()
@@ -0,0 +1,26 @@
+import os
+
+from core import RelationshipNetwork
+from render import ego_map_paths, load_network
+
+
+def test_load_network_replays_the_journal_without_truncating_it(tmp_path):
+    path = str(tmp_path / "relationships.json")
+    network = RelationshipNetwork(path)
+    network.load()
+    network.commit_change("add_person", "Alice")
+    network.save()
+    network.commit_change("set_relationship", "Alice", "Bob", "Friend")
+    journal = tmp_path / "relationships.journal"
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('[9, "add_person", "Ca')  #Still being written by the app
+    written = journal.read_text()
+
+    store, layout = load_network(path)
+    assert sorted(store.people()) == ["Alice", "Bob"]
+    assert journal.read_text() == written
+
+
+def test_ego_map_paths_never_share_a_file(tmp_path):
+    paths = ego_map_paths(str(tmp_path), ["A/B", "A_B", "a_b", "Carol"], ".png")
+    assert [os.path.basename(path) for path in paths] == ["A_B.png", "A_B (2).png", "a_b (3).png", "Carol.png"]
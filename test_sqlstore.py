@@ -0,0 +1,119 @@
+import random
+import sqlite3
+
+import pytest
+
+from analytics import NetworkAnalytics
+from persistence import RELATIONSHIP_STATUSES
+from sqlstore import SqliteStore
+from store import RelationshipStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    sqlite = SqliteStore(str(tmp_path / "relationships.db"))
+    yield RelationshipStore(), sqlite
+    sqlite.close()
+
+
+def random_changes(seed, count=400):
+    rng = random.Random(seed)
+    names = [f"Person {i}" for i in range(40)]
+    changes = []
+    for _ in range(count):
+        choice = rng.random()
+        if choice < 0.1:
+            changes.append(("add_person", rng.choice(names)))
+        elif choice < 0.7:
+            changes.append(("set_relationship", rng.choice(names), rng.choice(names), rng.choice(RELATIONSHIP_STATUSES)))
+        elif choice < 0.85:
+            changes.append(("remove_relationship", rng.choice(names), rng.choice(names)))
+        elif choice < 0.93:
+            changes.append(("remove_person", rng.choice(names)))
+        else:
+            old_name = rng.choice(names)
+            new_name = f"{old_name}'"
+            names[names.index(old_name)] = new_name
+            changes.append(("rename_person", old_name, new_name))
+    return changes
+
+
+def contents(store):
+    return ({name: dict(store.relations(name)) for name in store.people()}, store.relationship_count,
+            sorted(store.degrees()))
+
+
+def relationships(store):
+    #Either side of a relationship may come first
+    return sorted((*sorted((u, v)), status) for u, v, status in store.relationships())
+
+
+def groups(store):
+    analytics = NetworkAnalytics(store)
+    #People tied on PageRank may come in either order, only the scores are compared
+    ranking = [round(score, 12) for _, score in analytics.most_central(5)]
+    return analytics.largest_components(k=len(store)), analytics.component_count(), ranking
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sqlite_store_matches_the_memory_store(stores, seed):
+    memory, sqlite = stores
+    for op, *args in random_changes(seed):
+        results = [getattr(store, op)(*args) for store in stores]
+        assert results[0] == results[1], (op, args)
+
+    assert contents(memory) == contents(sqlite)
+    assert relationships(memory) == relationships(sqlite)
+    names = list(memory.people())[::2]
+    assert contents(memory.subgraph(names)) == contents(sqlite.subgraph(names))
+    assert groups(memory) == groups(sqlite)
+
+
+def test_bulk_adds_match(stores):
+    memory, sqlite = stores
+    changes = [("A", "B", "Friend"), ("B", "C", "Likes"), ("A", "B", "Exes"), ("D", "D", "Distant")]
+    for store in stores:
+        store.add_people(["A", "E"])
+        store.add_relationships(changes)
+    assert contents(memory) == contents(sqlite)
+
+
+def test_frozen_copy_ignores_later_changes(stores):
+    for store in stores:
+        store.set_relationship("A", "B", "Friend")
+        if isinstance(store, SqliteStore):
+            store.commit()
+        frozen = store.freeze()
+        store.set_relationship("A", "C", "Likes")
+        store.rename_person("B", "Bea")
+        assert sorted(frozen.people()) == ["A", "B"]
+        assert dict(frozen.relations("A")) == {"B": "Friend"}
+        assert sorted(store.relations("A")) == ["Bea", "C"]
+
+
+def test_reading_a_database_leaves_it_unchanged(tmp_path):
+    from importer import read_import
+    from persistence import load_file
+    from render import load_network
+    from sqlstore import write_database
+
+    path = str(tmp_path / "source.db")
+    write_database(path, ["Alice", "Bob"], [("Alice", "Bob", "Friend")], {"Alice": (1.0, 2.0)})
+    #As a database from elsewhere may be, opening it for writing would switch it to WAL
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=DELETE")
+    connection.close()
+    before = (tmp_path / "source.db").read_bytes()
+
+    assert read_import(path).relationships == {("Alice", "Bob"): "Friend"}
+    assert load_file(RelationshipStore(), path) == {"positions": {"Alice": (1.0, 2.0)}}
+    store, layout = load_network(path)
+    assert store.status("Alice", "Bob") == "Friend"
+    store.close()
+    assert (tmp_path / "source.db").read_bytes() == before
+
+
+def test_read_only_store_does_not_create_a_database(tmp_path):
+    with pytest.raises(Exception):
+        SqliteStore(str(tmp_path / "missing.db"), read_only=True)
+    assert not (tmp_path / "missing.db").exists()
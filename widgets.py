@@ -0,0 +1,176 @@
+import queue
+import tkinter as tk
+from tkinter import ttk
+
+THREAD_CALLS_POLL_MS = 50  #How often calls handed over from other threads are run
+
+
+class VirtualListbox(ttk.Frame):
+    """A scrollable list that only creates rows for the items currently in view.
+
+    It shows a window of `height` rows over any sequence of items, so its cost
+    depends on the viewport rather than on the number of items. curselection,
+    get and <<ListboxSelect>> behave like tk.Listbox, with indexes into items:
+    the arrow and page keys only move the active row, a click or Return
+    selects it.
+    """
+
+    def __init__(self, master, height=10, formatter=str, **listbox_options):
+        super().__init__(master)
+        self.items = []
+        self.height = height
+        self.formatter = formatter  #Turns an item into the text of its row
+        self.top = 0  #Index of the first visible item
+        self.selected = None  #Index of the selected item
+        self.active = None  #Index of the item the keyboard is on
+
+        self.listbox = tk.Listbox(self, height=height, exportselection=False, **listbox_options)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.listbox.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.columnconfigure(0, weight=1)
+
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", self._on_wheel)
+        self.listbox.bind("<Button-4>", lambda e: self._scroll_by(-3))
+        self.listbox.bind("<Button-5>", lambda e: self._scroll_by(3))
+        self.listbox.bind("<Up>", lambda e: self._move_active(-1))
+        self.listbox.bind("<Down>", lambda e: self._move_active(1))
+        self.listbox.bind("<Prior>", lambda e: self._move_active(-self.height))
+        self.listbox.bind("<Next>", lambda e: self._move_active(self.height))
+        self.listbox.bind("<Return>", self._select_active)
+
+    def set_items(self, items):
+        """Replaces the items, keeping the scroll position where possible."""
+        self.items = items
+        self.selected = None
+        self.active = None
+        self.top = self._clamp_top(self.top)
+        self.redraw()
+
+    def update_item(self, index, item):
+        self.items[index] = item
+        if self.top <= index < self.top + self.height:
+            self.listbox.delete(index - self.top)
+            self.listbox.insert(index - self.top, self.formatter(item))
+            self._show_selection()
+
+    def append_item(self, item):
+        self.items.append(item)
+        if len(self.items) <= self.top + self.height:
+            self.listbox.insert(tk.END, self.formatter(item))
+        self.redraw_scrollbar()
+
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def get(self, index):
+        if isinstance(index, tuple):
+            index = index[0]
+        return self.items[index]
+
+    def see(self, index):
+        if index < self.top:
+            self.scroll_to(index)
+        elif index >= self.top + self.height:
+            self.scroll_to(index - self.height + 1)
+
+    def scroll_to(self, top):
+        top = self._clamp_top(top)
+        if top != self.top:
+            self.top = top
+            self.redraw()
+
+    def yview(self, *args):
+        #Called by the scrollbar with ("moveto", fraction) or ("scroll", count, "units" or "pages")
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.items)))
+        elif args[0] == "scroll":
+            count = int(args[1])
+            self._scroll_by(count * self.height if args[2] == "pages" else count)
+
+    def redraw(self):
+        """Rebuilds only the visible rows."""
+        rows = [self.formatter(item) for item in self.items[self.top:self.top + self.height]]
+        self.listbox.delete(0, tk.END)
+        if rows:
+            self.listbox.insert(0, *rows)
+        self._show_selection()
+        self.redraw_scrollbar()
+
+    def redraw_scrollbar(self):
+        if self.items:
+            self.scrollbar.set(self.top / len(self.items), min(1.0, (self.top + self.height) / len(self.items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _clamp_top(self, top):
+        return max(0, min(top, len(self.items) - self.height))
+
+    def _show_selection(self):
+        self.listbox.selection_clear(0, tk.END)
+        if self.selected is not None and self.top <= self.selected < self.top + self.height:
+            self.listbox.selection_set(self.selected - self.top)
+        if self.active is not None and self.top <= self.active < self.top + self.height:
+            self.listbox.activate(self.active - self.top)
+
+    def _scroll_by(self, count):
+        self.scroll_to(self.top + count)
+        return "break"
+
+    def _on_wheel(self, event):
+        return self._scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected = self.active = self.top + selection[0]
+            self.event_generate("<<ListboxSelect>>")
+
+    def _move_active(self, count):
+        #Like tk.Listbox in single mode, the keys move the active row without selecting it
+        if not self.items:
+            return "break"
+
+        current = self.active
+        if current is None:
+            current = self.top if self.selected is None else self.selected
+        self.active = max(0, min(current + count, len(self.items) - 1))
+        self.see(self.active)
+        self._show_selection()
+        return "break"
+
+    def _select_active(self, event):
+        if self.active is not None:
+            self.selected = self.active
+            self._show_selection()
+            self.event_generate("<<ListboxSelect>>")
+        return "break"
+
+
+class ThreadCalls:
+    """Runs functions handed over from other threads on the Tk thread, which picks them up with after().
+
+    A thread other than the one running mainloop must not call Tk itself:
+    even root.after waits for mainloop to serve it, so a worker doing so
+    while the Tk thread waits for that worker would never return. Calling
+    a ThreadCalls only queues the function.
+    """
+
+    def __init__(self, root, interval=THREAD_CALLS_POLL_MS):
+        self.root = root
+        self.interval = interval
+        self.queue = queue.Queue()
+        self._poll()
+
+    def __call__(self, function, *args):
+        self.queue.put((function, args))
+
+    def _poll(self):
+        while True:
+            try:
+                function, args = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            function(*args)
+        self.root.after(self.interval, self._poll)